@@ -0,0 +1,16 @@
+from django.db import models
+
+class Category(models.Model):
+    name = models.CharField(max_length=50)
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50)
+
+class Item(models.Model):
+    name = models.CharField(max_length=100)
+    description = models.TextField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.IntegerField()
+    created = models.DateTimeField()
+    category = models.ForeignKey(Category)
+    tags = models.ManyToManyField(Tag)
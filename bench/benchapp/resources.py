@@ -0,0 +1,89 @@
+import datetime
+
+from webmachine import Resource, WM
+from webmachine.exc import HTTPForbidden
+from webmachine.helpers.serialize import JSONSerializer, \
+StreamingJSONSerializer
+
+from benchapp.models import Item
+
+MODIFIED = datetime.datetime(2011, 1, 1)
+
+class Trivial(Resource):
+
+    def to_html(self, req, resp):
+        return "<html><body>Hello world!</body></html>\n"
+
+class Negotiated(Resource):
+
+    def content_types_provided(self, req, resp):
+        return (
+            ("text/html", self.to_html),
+            ("application/xhtml+xml", self.to_html),
+            ("application/json", self.to_json),
+            ("text/plain", self.to_text),
+        )
+
+    def languages_provided(self, req, resp):
+        return ["en", "fr", "de"]
+
+    def charsets_provided(self, req, resp):
+        return [
+            ("utf-8", lambda v: v),
+            ("iso-8859-1", lambda v: v),
+        ]
+
+    def to_html(self, req, resp):
+        return "<html><body>Hello world!</body></html>\n"
+
+    def to_json(self, req, resp):
+        return '{"message": "hello world!"}\n'
+
+    def to_text(self, req, resp):
+        return "Hello world!\n"
+
+class Conditional(Resource):
+
+    def generate_etag(self, req, resp):
+        return "bench"
+
+    def last_modified(self, req, resp):
+        return MODIFIED
+
+    def to_html(self, req, resp):
+        return "<html><body>Hello world!</body></html>\n"
+
+class Missing(Trivial):
+
+    def resource_exists(self, req, resp):
+        return False
+
+class Forbidden(Trivial):
+
+    def forbidden(self, req, resp):
+        raise HTTPForbidden()
+
+
+bench_wm = WM("bench")
+
+@bench_wm.route(r"^echo$", methods="POST",
+        provided=[("application/json", JSONSerializer())],
+        accepted=[("application/json", JSONSerializer())])
+def echo(req, resp):
+    return req.raw_post_data
+
+@bench_wm.route(r"^items$",
+        provided=[("application/json", JSONSerializer())])
+def items(req, resp):
+    return Item.objects.all()
+
+@bench_wm.route(r"^items/related$",
+        provided=[("application/json", JSONSerializer(
+            fields=("name", "price", "category", "tags")))])
+def items_related(req, resp):
+    return Item.objects.all()
+
+@bench_wm.route(r"^items/stream$",
+        provided=[("application/json", StreamingJSONSerializer())])
+def items_stream(req, resp):
+    return Item.objects.all()
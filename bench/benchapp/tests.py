@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -
+#
+# This file is part of dj-webmachine released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Regression tests run against the benchmark app::
+
+    $ cd bench && django-admin.py test benchapp --settings=settings \
+--pythonpath=.
+"""
+
+import datetime
+import decimal
+import json
+import sys
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.test import TestCase
+from webob.datetime_utils import UTC
+
+from webmachine import Resource, WM
+from webmachine.cache import LocalRepresentationCache
+from webmachine.exc import HTTPNotFound
+from webmachine.helpers import serialize
+from webmachine.metrics import Histogram
+from webmachine.helpers.serialize import JSONSerializer, \
+NDJSONSerializer, StreamingJSONSerializer, value_to_emittable
+from webmachine.wrappers import WMRequest
+
+from benchapp.models import Category, Item
+
+
+def request(path="/", method="GET", body="", **headers):
+    environ = {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "SCRIPT_NAME": "",
+        "QUERY_STRING": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": StringIO(body),
+        "wsgi.url_scheme": "http",
+        "wsgi.errors": sys.stderr,
+    }
+    environ.update(headers)
+    return WSGIRequest(environ)
+
+def status(resp):
+    # webmachine.exc responses have a "CODE Title" status
+    return int(str(resp.status_code).split()[0])
+
+def create_items(count=3):
+    category = Category.objects.create(name="category")
+    for i in range(count):
+        Item.objects.create(name="item %s" % i, description="",
+                price=decimal.Decimal("1.50"), quantity=i,
+                created=datetime.datetime(2011, 1, i + 1, 12),
+                category=category)
+
+
+class SerializeTest(TestCase):
+
+    def setUp(self):
+        create_items()
+
+    def test_dates(self):
+        qs = Item.objects.dates("created", "day")
+        expected = ["2011-01-01T00:00:00Z", "2011-01-02T00:00:00Z",
+                "2011-01-03T00:00:00Z"]
+        self.assertEqual(json.loads(JSONSerializer().serialize(qs)),
+                expected)
+        body = "".join(StreamingJSONSerializer().serialize(qs))
+        self.assertEqual(json.loads(body), expected)
+
+    def test_related_managers_not_cached(self):
+        category = Category.objects.get()
+        value_to_emittable(category.item_set)
+        before = len(serialize._emitters)
+        for i in range(10):
+            self.assertEqual(len(value_to_emittable(category.item_set)), 3)
+        self.assertEqual(len(serialize._emitters), before)
+
+    def test_values(self):
+        qs = Item.objects.order_by("quantity").values_list("quantity",
+                flat=True)
+        self.assertEqual(json.loads(JSONSerializer().serialize(qs)),
+                [0, 1, 2])
+
+
+class RequestTest(TestCase):
+
+    def form(self):
+        return WMRequest(request("/items", "POST", "a=1&b=2",
+            QUERY_STRING="q=x",
+            CONTENT_TYPE="application/x-www-form-urlencoded",
+            HTTP_AUTHORIZATION="Basic dXNlcjpwYXNz"))
+
+    def test_webob_properties(self):
+        req = self.form()
+        self.assertEqual(req.url, "http://localhost/items?q=x")
+        self.assertEqual(req.host_url, "http://localhost")
+        self.assertEqual(req.authorization, ("Basic", "dXNlcjpwYXNz"))
+        self.assertEqual(dict(req.params), {"q": "x", "a": "1", "b": "2"})
+        self.assertEqual(req.webob_WGET["q"], "x")
+        self.assertRaises(AttributeError, getattr, req, "missing")
+
+    def test_body_shared(self):
+        req = self.form()
+        self.assertEqual(req.webob_POST["a"], "1")
+        self.assertEqual(req.str_POST["b"], "2")
+        self.assertEqual(req.POST["a"], "1")
+        self.assertEqual(req.body, "a=1&b=2")
+
+
+class HeadTest(TestCase):
+
+    def setUp(self):
+        self.wm = WM("tests")
+
+        @self.wm.route(r"^items/(?P<name>\w+)$")
+        def item(req, resp):
+            name = req.url_kwargs["name"]
+            if name != "found":
+                raise HTTPNotFound()
+            resp["X-Item"] = name
+            return "<p>%s</p>" % name
+
+        self.resource = self.wm.resources[r"^items/(?P<name>\w+)$"]
+
+    def fetch(self, method, name):
+        return self.resource(request("/items/%s" % name, method),
+                name=name)
+
+    def test_route_not_found(self):
+        get = self.fetch("GET", "missing")
+        head = self.fetch("HEAD", "missing")
+        self.assertEqual(status(get), 404)
+        self.assertEqual(status(head), 404)
+
+    def test_route_headers(self):
+        get = self.fetch("GET", "found")
+        head = self.fetch("HEAD", "found")
+        self.assertEqual(status(head), 200)
+        self.assertEqual(head["X-Item"], get["X-Item"])
+        self.assertEqual(head["Content-Length"], get["Content-Length"])
+        self.assertEqual("".join(head), "")
+
+
+class CachedResource(Resource):
+    representation_cache = None
+    calls = 0
+
+    def generate_etag(self, req, resp):
+        return "v1"
+
+    def to_html(self, req, resp):
+        CachedResource.calls += 1
+        resp["X-Custom"] = "custom"
+        resp.content_type = "text/html; version=1"
+        return u"<p>caf\xe9</p>"
+
+
+class RepresentationCacheTest(TestCase):
+
+    def setUp(self):
+        CachedResource.representation_cache = LocalRepresentationCache()
+        CachedResource.calls = 0
+
+    def test_headers_on_hit(self):
+        miss = CachedResource()(request())
+        hit = CachedResource()(request())
+        self.assertEqual(CachedResource.calls, 1)
+        self.assertEqual(hit.items(), miss.items())
+        self.assertEqual(hit.content, miss.content)
+
+    def test_head_headers_on_hit(self):
+        miss = CachedResource()(request())
+        hit = CachedResource()(request(method="HEAD"))
+        self.assertEqual(CachedResource.calls, 1)
+        self.assertEqual(hit["X-Custom"], "custom")
+        self.assertEqual(hit["Content-Type"], miss["Content-Type"])
+
+
+class ValidatedResource(Resource):
+    exists = True
+
+    def validators(self, req, resp):
+        return ("v1", datetime.datetime(2011, 1, 1, tzinfo=UTC))
+
+    def resource_exists(self, req, resp):
+        return self.exists
+
+    def to_html(self, req, resp):
+        return "<p>validated</p>"
+
+
+class ValidatorsTest(TestCase):
+
+    def test_found(self):
+        resp = ValidatedResource()(request())
+        self.assertEqual(status(resp), 200)
+        self.assertEqual(resp["ETag"], '"v1"')
+        self.assertTrue(resp.has_header("Last-Modified"))
+
+    def test_not_found(self):
+        resource = ValidatedResource()
+        resource.exists = False
+        resp = resource(request())
+        self.assertEqual(status(resp), 404)
+        self.assertFalse(resp.has_header("ETag"))
+        self.assertFalse(resp.has_header("Last-Modified"))
+
+
+class HistogramTest(TestCase):
+
+    def test_range(self):
+        hist = Histogram()
+        hist.record(16e-6)
+        self.assertEqual(hist.percentile(100), 16e-6)
+        hist = Histogram()
+        hist.record(15)
+        self.assertEqual(hist.percentile(100), 2 ** 24 / 1e6)
+
+
+class SchemaTest(TestCase):
+
+    def setUp(self):
+        self.wm = WM("tests")
+
+        @self.wm.route(r"^items$", methods=["POST"],
+                accepted=[
+                    ("application/json", JSONSerializer(schema=Item)),
+                    ("application/x-ndjson", NDJSONSerializer(schema=Item))
+                ],
+                provided=[("application/json", JSONSerializer())])
+        def items(req, resp):
+            return [item["quantity"] for item in req.raw_post_data]
+
+        self.resource = self.wm.resources[r"^items$"]
+
+    def post(self, body, ctype):
+        return self.resource(request("/items", "POST", body,
+            CONTENT_TYPE=ctype, HTTP_ACCEPT="application/json"))
+
+    def test_converted(self):
+        resp = self.post('[{"quantity": "12"}]', "application/json")
+        self.assertEqual(status(resp), 200)
+        self.assertEqual(json.loads(resp.content), [12])
+
+    def test_bad_value(self):
+        resp = self.post('[{"quantity": "abc"}]', "application/json")
+        self.assertEqual(status(resp), 400)
+
+    def test_bad_stream_value(self):
+        resp = self.post('{"quantity": "1"}\n{"quantity": "abc"}\n',
+                "application/x-ndjson")
+        self.assertEqual(status(resp), 400)
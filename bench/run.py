@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -
+#
+# This file is part of dj-webmachine released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Benchmarks of the request pipeline. Requests are built from synthetic
+WSGI environs, resolved with the Django urlconf and passed to the
+resources, no server is involved.
+
+Usage::
+
+    $ python bench/run.py [-n REQUESTS] [-o results.json] [case ...]
+
+Results are written as JSON, one object per case, so two runs can be
+compared to detect regressions. ``live_objects_per_req`` is the growth
+of the gc tracked objects alive when a response is returned, the
+collector being disabled. It isn't an allocation count: the objects
+freed during the request and the untracked ones (strings, numbers) are
+missed. ``live_objects_retained`` counts the ones still alive once the
+response is released and collected.
+"""
+
+import gc
+import json
+import optparse
+import os
+import platform
+import sys
+import time
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+BENCH_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_ROOT)
+sys.path.insert(0, os.path.dirname(BENCH_ROOT))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management import call_command
+from django.core.urlresolvers import get_resolver
+
+import webmachine
+
+ITEMS = 500
+
+COMPLEX_ACCEPT = ("application/xhtml+xml;q=0.9,text/html;level=1;q=0.8,"
+        "application/json;q=0.95,text/plain;q=0.5,image/png,*/*;q=0.1")
+
+def environ(path, method="GET", body="", **headers):
+    env = {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "SCRIPT_NAME": "",
+        "QUERY_STRING": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": StringIO(body),
+        "wsgi.url_scheme": "http",
+        "wsgi.errors": sys.stderr,
+    }
+    env.update(headers)
+    return env
+
+CASES = [
+    ("trivial_get", 200, dict(path="/trivial")),
+    ("conneg_complex_accept", 200, dict(path="/negotiated",
+        HTTP_ACCEPT=COMPLEX_ACCEPT,
+        HTTP_ACCEPT_LANGUAGE="da, fr;q=0.8, en-gb;q=0.7, en;q=0.5",
+        HTTP_ACCEPT_CHARSET="iso-8859-5, utf-8;q=0.9, *;q=0.1")),
+    ("conditional_304", 304, dict(path="/conditional",
+        HTTP_IF_NONE_MATCH='"bench"')),
+    ("post_json", 200, dict(path="/wm/echo", method="POST",
+        body=json.dumps({"name": "bench", "values": range(50)}),
+        CONTENT_TYPE="application/json", HTTP_ACCEPT="application/json")),
+    ("queryset_json", 200, dict(path="/wm/items",
+        HTTP_ACCEPT="application/json")),
+    ("queryset_json_related", 200, dict(path="/wm/items/related",
+        HTTP_ACCEPT="application/json")),
+    ("queryset_json_stream", 200, dict(path="/wm/items/stream",
+        HTTP_ACCEPT="application/json")),
+    ("error_404", 404, dict(path="/missing")),
+    ("error_403_exc", 403, dict(path="/forbidden")),
+]
+
+def setup_db(count=ITEMS):
+    import datetime
+    import decimal
+    from benchapp.models import Category, Tag, Item
+
+    call_command("syncdb", interactive=False, verbosity=0)
+    categories = [Category.objects.create(name="category %s" % i) \
+            for i in range(10)]
+    tags = [Tag.objects.create(name="tag %s" % i) for i in range(5)]
+    for i in range(count):
+        item = Item.objects.create(name="item %s" % i,
+                description="description of item %s" % i,
+                price=decimal.Decimal("%s.99" % i), quantity=i,
+                created=datetime.datetime(2011, 1, 1, 12, i % 60),
+                category=categories[i % len(categories)])
+        item.tags.add(*tags[:i % len(tags)])
+
+def request(resolver, kwargs):
+    kwargs = kwargs.copy()
+    path = kwargs.pop("path")
+    req = WSGIRequest(environ(path, **kwargs))
+    view, args, view_kwargs = resolver.resolve(path)
+    resp = view(req, *args, **view_kwargs)
+    # consume the body like a server would
+    "".join(resp)
+    return resp
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def run_case(resolver, name, status, kwargs, count, warmup=50):
+    resp = request(resolver, kwargs)
+    # webmachine.exc responses set a "CODE Title" status
+    if int(str(resp.status_code).split()[0]) != status:
+        raise AssertionError("%s: expected %s, got %s" % (name, status,
+            resp.status_code))
+
+    for i in xrange(warmup):
+        request(resolver, kwargs)
+
+    timings = []
+    gc.collect()
+    for i in xrange(count):
+        start = time.time()
+        request(resolver, kwargs)
+        timings.append(time.time() - start)
+    total = sum(timings)
+    timings.sort()
+
+    # live gc tracked objects growth
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        last = request(resolver, kwargs)
+        objects = len(gc.get_objects()) - before
+        del last
+        gc.collect()
+        retained = len(gc.get_objects()) - before
+    finally:
+        gc.enable()
+
+    return {
+        "name": name,
+        "status": status,
+        "requests": count,
+        "req_per_sec": count / total,
+        "latency_ms": {
+            "mean": total / count * 1000,
+            "p50": percentile(timings, 0.5) * 1000,
+            "p90": percentile(timings, 0.9) * 1000,
+            "p99": percentile(timings, 0.99) * 1000,
+            "max": timings[-1] * 1000
+        },
+        "live_objects_per_req": objects,
+        "live_objects_retained": retained
+    }
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] [case ...]")
+    parser.add_option("-n", "--requests", type="int", default=1000,
+            help="number of requests per case")
+    parser.add_option("-o", "--output", default="-",
+            help="file where results are written, default stdout")
+    parser.add_option("-l", "--list", action="store_true", default=False,
+            help="list the cases")
+    opts, names = parser.parse_args()
+
+    if opts.list:
+        for name, status, kwargs in CASES:
+            print name
+        return
+
+    unknown = set(names) - set([c[0] for c in CASES])
+    if unknown:
+        parser.error("unknown case(s): %s" % ", ".join(sorted(unknown)))
+
+    setup_db()
+    resolver = get_resolver(None)
+    results = []
+    for name, status, kwargs in CASES:
+        if names and name not in names:
+            continue
+        requests = opts.requests
+        if name.startswith("queryset_json"):
+            # each request serializes the whole table
+            requests = max(1, requests // 20)
+        results.append(run_case(resolver, name, status, kwargs, requests))
+
+    report = {
+        "time": time.time(),
+        "python": platform.python_version(),
+        "webmachine": webmachine.__version__,
+        "results": results
+    }
+    if opts.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        f = open(opts.output, "w")
+        try:
+            json.dump(report, f, indent=2)
+        finally:
+            f.close()
+
+if __name__ == "__main__":
+    main()
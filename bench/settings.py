@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -
+#
+# This file is part of dj-webmachine released under the MIT license. 
+# See the NOTICE for more information.
+
+# Django settings for the benchmarks.
+
+DEBUG = False
+TEMPLATE_DEBUG = DEBUG
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+TIME_ZONE = 'UTC'
+LANGUAGE_CODE = 'en-us'
+USE_I18N = True
+USE_L10N = False
+
+SECRET_KEY = 'bench-not-secret'
+
+MIDDLEWARE_CLASSES = ()
+
+ROOT_URLCONF = 'urls'
+
+INSTALLED_APPS = (
+    'benchapp',
+)
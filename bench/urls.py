@@ -0,0 +1,13 @@
+from django.conf.urls.defaults import *
+
+from benchapp.resources import bench_wm, Trivial, Negotiated, \
+Conditional, Missing, Forbidden
+
+urlpatterns = patterns('',
+    (r'^trivial$', Trivial()),
+    (r'^negotiated$', Negotiated()),
+    (r'^conditional$', Conditional()),
+    (r'^missing$', Missing()),
+    (r'^forbidden$', Forbidden()),
+    (r'^wm/', include(bench_wm.urls)),
+)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -
+#
+# This file is part of dj-webmachine released under the MIT license. 
+# See the NOTICE for more information.
+
+"""
+Representation caches. When a resource has a ``representation_cache``
+and generates an etag, the body built for a negotiated variant is
+stored, with the headers its content handler set, and reused for the
+next GET returning the same etag:
+
+.. code-block:: python
+
+    from webmachine import Resource
+    from webmachine.cache import LocalRepresentationCache
+
+    class MyResource(Resource):
+        representation_cache = LocalRepresentationCache(size=500)
+
+        def generate_etag(self, req, resp):
+            return get_version()
+
+Streamed bodies aren't cached.
+"""
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from webmachine.util import LRUCache
+
+
+def header_key(name):
+    """ return the key of a request header in META """
+    return "HTTP_%s" % name.upper().replace("-", "_")
+
+
+class RepresentationCache(object):
+
+    def key(self, res, req, resp):
+        """ return the key of the representation, built from the
+        resource, the url and its arguments, the negotiated variant, the
+        request headers in Vary and the etag. """
+        cls = res.__class__
+        varied = [(name.lower(), req.META.get(header_key(name))) \
+                for name in (resp.vary or []) if name != "*"]
+        parts = ("%s.%s" % (cls.__module__, cls.__name__),
+                req.path, req.META.get("QUERY_STRING", ""), req.url_args,
+                sorted(req.url_kwargs.items()), resp.content_type,
+                resp.content_language, resp._charset, resp.wm_encoding,
+                sorted(varied), resp.etag)
+        return md5(repr(parts)).hexdigest()
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+
+class LocalRepresentationCache(RepresentationCache):
+    """ in-process cache of the most recently used representations """
+
+    def __init__(self, size=1024):
+        self.cache = LRUCache(size)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache[key] = value
+
+
+class DjangoRepresentationCache(RepresentationCache):
+    """ store representations in a Django cache backend """
+
+    def __init__(self, cache=None, timeout=None, key_prefix="wmrepr"):
+        """
+        :attr cache: Django cache backend, default is
+        ``django.core.cache.cache``
+        :attr timeout: expiration in seconds, default is the backend
+        timeout
+        """
+        if cache is None:
+            from django.core.cache import cache
+        self.cache = cache
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        return self.cache.get("%s:%s" % (self.key_prefix, key))
+
+    def set(self, key, value):
+        key = "%s:%s" % (self.key_prefix, key)
+        if self.timeout is None:
+            self.cache.set(key, value)
+        else:
+            self.cache.set(key, value, self.timeout)
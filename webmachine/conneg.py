@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -
+#
+# This file is part of dj-webmachine released under the MIT license. 
+# See the NOTICE for more information.
+
+"""
+Content negotiation. Clients only send a few distinct ``Accept-*``
+headers, so the result of a negotiation is kept in a bounded cache
+keyed on the raw header and the values offered by the resource.
+"""
+
+from webmachine.util import LRUCache
+
+# request attribute parsing each negotiated header
+HEADERS = {
+    "accept": "HTTP_ACCEPT",
+    "accept_charset": "HTTP_ACCEPT_CHARSET",
+    "accept_encoding": "HTTP_ACCEPT_ENCODING",
+    "accept_language": "HTTP_ACCEPT_LANGUAGE"
+}
+
+class Negotiator(object):
+
+    def __init__(self, size=1024):
+        """
+        :attr size: maximum number of negotiation results kept.
+        """
+        self.results = LRUCache(size)
+        self.hits = 0
+        self.misses = 0
+
+    def best_match(self, req, kind, offers):
+        """ return the best of ``offers`` for the header parsed by
+        ``req.<kind>`` or None. """
+        offers = tuple(offers)
+        key = (kind, req.META.get(HEADERS[kind]), offers)
+        try:
+            match = self.results[key]
+        except KeyError:
+            self.misses += 1
+            match = getattr(req, kind).best_match(list(offers))
+            self.results[key] = match
+        else:
+            self.hits += 1
+        return match
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.results)
+        }
+
+    def clear(self):
+        self.results.clear()
+        self.hits = self.misses = 0
+
+negotiator = Negotiator()
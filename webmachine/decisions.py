@@ -5,36 +5,62 @@
 
 import datetime
 
+from django.utils.encoding import smart_str
+from webob.byterange import ContentRange
 from webob.datetime_utils import UTC
 import webmachine.exc
+from webmachine.util import MediaTable
+
+# callbacks whose result can be reused during a request
+CACHEABLE_CALLBACKS = ("charsets_provided", "content_types_accepted",
+"content_types_provided", "encodings_provided", "expires",
+"generate_etag", "languages_provided", "last_modified", "validators",
+"variances")
+
+def callback(res, name, req, resp):
+    """ call the resource callback ``name``. When the resource caches
+    its callbacks the result is computed only once per request. Values
+    already set in ``req.wm_callbacks`` are always used. """
+    cache = req.wm_callbacks
+    if cache is not None and name in cache:
+        return cache[name]
+
+    if res.metrics is None:
+        value = getattr(res, name)(req, resp)
+    else:
+        value = res.metrics.timed(res, name, getattr(res, name), req, resp)
+
+    if cache is not None and res.cache_callbacks and name in res._cacheable:
+        cache[name] = value
+    return value
 
 def b03(res, req, resp):
     "Options?"
     if req.method == 'OPTIONS':
-        for (header, value) in res.options(req, resp):
+        for (header, value) in callback(res, "options", req, resp):
             resp[header] = value
         return True
     return False
 
 def b04(res, req, resp):
     "Request entity too large?"
-    return not res.valid_entity_length(req, resp)
+    return not callback(res, "valid_entity_length", req, resp)
 
 def b05(res, req, resp):
     "Unknown Content-Type?"
-    return not res.known_content_type(req, resp)
+    return not callback(res, "known_content_type", req, resp)
 
 def b06(res, req, resp):
     "Unknown or unsupported Content-* header?"
-    return not res.valid_content_headers(req, resp)
+    return not callback(res, "valid_content_headers", req, resp)
 
 def b07(res, req, resp):
     "Forbidden?"
-    return res.forbidden(req, resp)
+    return callback(res, "forbidden", req, resp)
 
 def b08(res, req, resp):
     "Authorized?"
-    auth = res.is_authorized(req, resp)
+    auth = callback(res, "is_authorized", req, resp)
     if auth is True:
         return True
     elif isinstance(auth, basestring):
@@ -43,25 +69,67 @@ def b08(res, req, resp):
 
 def b09(res, req, resp):
     "Malformed?"
-    return res.malformed_request(req, resp)
+    return callback(res, "malformed_request", req, resp)
 
 def b10(res, req, resp):
     "Is method allowed?"
-    if req.method in res.allowed_methods(req, resp):
+    if req.method in callback(res, "allowed_methods", req, resp):
         return True
     return False 
 
 def b11(res, req, resp):
     "URI too long?"
-    return res.uri_too_long(req, resp)
+    return callback(res, "uri_too_long", req, resp)
 
 def b12(res, req, resp):
     "Known method?"
-    return req.method in res.known_methods(req, resp)
+    return req.method in callback(res, "known_methods", req, resp)
 
 def b13(res, req, resp):
     "Service available?"
-    return res.ping(req, resp) and res.service_available(req, resp)
+    return callback(res, "ping", req, resp) and \
+            callback(res, "service_available", req, resp)
+
+def c01(res, req, resp):
+    "Precondition failed on validators?"
+    validators = callback(res, "validators", req, resp)
+    if req.wm_callbacks is None:
+        req.wm_callbacks = {}
+    req.wm_callbacks["validators"] = validators
+    if validators is None:
+        return False
+
+    # validators replace generate_etag and last_modified
+    (etag, last_modified) = validators
+    req.wm_callbacks.update({
+        "generate_etag": etag,
+        "last_modified": last_modified
+    })
+    resp.etag = etag
+    resp.last_modified = last_modified
+
+    if "HTTP_IF_MATCH" in req.META and etag is not None and \
+            '*' not in req.if_match:
+        return etag not in req.if_match
+    if req.if_unmodified_since and resp.last_modified:
+        return resp.last_modified > req.if_unmodified_since
+    return False
+
+def c02(res, req, resp):
+    "Not modified on validators?"
+    validators = callback(res, "validators", req, resp)
+    if validators is None or req.method not in ("GET", "HEAD"):
+        return False
+
+    if "HTTP_IF_NONE_MATCH" in req.META:
+        if validators[0] is None or '*' in req.if_none_match:
+            return False
+        return validators[0] in req.if_none_match
+    if req.if_modified_since and resp.last_modified:
+        if req.if_modified_since > datetime.datetime.now(UTC):
+            return False
+        return resp.last_modified <= req.if_modified_since
+    return False
 
 def c03(res, req, resp):
     "Accept exists?"
@@ -69,8 +137,9 @@ def c03(res, req, resp):
 
 def c04(res, req, resp):
     "Acceptable media type available?"
-    ctypes = [ctype for (ctype, func) in res.content_types_provided(req, resp)]
-    ctype = req.accept.best_match(ctypes)
+    ctypes = media_types(callback(res, "content_types_provided", req,
+        resp))
+    ctype = res.negotiator.best_match(req, "accept", ctypes)
     if ctype is None:
         return False
     resp.content_type = ctype
@@ -82,9 +151,9 @@ def d04(res, req, resp):
 
 def d05(res, req, resp):
     "Accept-Language available?"
-    langs = res.languages_provided(req, resp)
+    langs = callback(res, "languages_provided", req, resp)
     if langs is not None:
-        lang = req.accept_language.best_match(langs)
+        lang = res.negotiator.best_match(req, "accept_language", langs)
         if lang is None:
             return False
         resp.content_language = lang
@@ -96,9 +165,11 @@ def e05(res, req, resp):
 
 def e06(res, req, resp):
     "Acceptable charset available?"
-    charsets = res.charsets_provided(req, resp)
+    charsets = callback(res, "charsets_provided", req, resp)
     if charsets is not None:
-        charset = req.accept_charset.best_match(charsets)
+        charsets = [cset for (cset, func) in charsets]
+        charset = res.negotiator.best_match(req, "accept_charset",
+                charsets)
         if charset is None:
             return False
         resp._charset = charset
@@ -110,13 +181,14 @@ def f06(res, req, resp):
 
 def f07(res, req, resp):
     "Acceptable encoding available?"
-    encodings = res.encodings_provided(req, resp)
+    encodings = callback(res, "encodings_provided", req, resp)
     if encodings is not None:
         encodings = [enc for (enc, func) in encodings]
-        enc = req.accept_encoding.best_match(encodings)
+        enc = res.negotiator.best_match(req, "accept_encoding",
+                encodings)
         if enc is None:
             return False
-        resp.content_encoding = enc
+        resp.wm_encoding = enc
     return True
 
 def g07(res, req, resp):
@@ -124,18 +196,25 @@ def g07(res, req, resp):
 
     # Set variances now that conneg is done
     hdr = []
-    if len(res.content_types_provided(req, resp) or []) > 1:
+    if len(callback(res, "content_types_provided", req, resp) or []) > 1:
         hdr.append("Accept")
-    if len(res.charsets_provided(req, resp) or []) > 1:
+    if len(callback(res, "charsets_provided", req, resp) or []) > 1:
         hdr.append("Accept-Charset")
-    if len(res.encodings_provided(req, resp) or []) > 1:
+    if len(callback(res, "encodings_provided", req, resp) or []) > 1:
         hdr.append("Accept-Encoding")
-    if len(res.languages_provided(req, resp) or []) > 1:
+    if len(callback(res, "languages_provided", req, resp) or []) > 1:
         hdr.append("Accept-Language")
-    hdr.extend(res.variances(req, resp))
+    hdr.extend(callback(res, "variances", req, resp))
     resp.vary = hdr
 
-    return res.resource_exists(req, resp)
+    if callback(res, "resource_exists", req, resp):
+        return True
+
+    # the validators set in c01 describe a representation that
+    # doesn't exist
+    del resp.etag
+    del resp.last_modified
+    return False
 
 def g08(res, req, resp):
     "If-Match exists?"
@@ -147,7 +226,7 @@ def g09(res, req, resp):
 
 def g11(res, req, resp):
     "Etag in If-Match?"
-    return res.generate_etag(req, resp) in req.if_match
+    return callback(res, "generate_etag", req, resp) in req.if_match
 
 def h07(res, req, resp):
     "If-Match: * exists?"
@@ -157,7 +236,7 @@ def h07(res, req, resp):
 
 def h10(res, req, resp):
     "If-Unmodified-Since exists?"
-    return "HTTP_IF_MODIFIED_SINCE" in req.META
+    return "HTTP_IF_UNMODIFIED_SINCE" in req.META
 
 def h11(res, req, resp):
     "If-Unmodified-Since is a valid date?"
@@ -168,12 +247,14 @@ def h12(res, req, resp):
     if not req.if_unmodified_since:
         return True
 
-    resp.last_modified = res.last_modified(req, resp)
+    resp.last_modified = callback(res, "last_modified", req, resp)
+    if not resp.last_modified:
+        return False
     return resp.last_modified > req.if_unmodified_since
 
 def i04(res, req, resp):
     "Apply to a different URI?"
-    uri = res.moved_permanently(req, resp)
+    uri = callback(res, "moved_permanently", req, resp)
     if not uri:
         return False
     resp.location = uri
@@ -197,7 +278,7 @@ def j18(res, req, resp):
 
 def k05(res, req, resp):
     "Resource moved permanently?"
-    uri = res.moved_permanently(req, resp)
+    uri = callback(res, "moved_permanently", req, resp)
     if not uri:
         return False
     resp.location = uri
@@ -205,16 +286,16 @@ def k05(res, req, resp):
 
 def k07(res, req, resp):
     "Resource previously existed?"
-    return res.previously_existed(req, resp)
+    return callback(res, "previously_existed", req, resp)
 
 def k13(res, req, resp):
     "Etag in If-None-Match?"
-    resp.etag = res.generate_etag(req, resp)
+    resp.etag = callback(res, "generate_etag", req, resp)
     return resp.etag in req.if_none_match
 
 def l05(res, req, resp):
     "Resource moved temporarily?"
-    uri = res.moved_temporarily(req, resp)
+    uri = callback(res, "moved_temporarily", req, resp)
     if not uri:
         return False
     resp.location = uri
@@ -238,7 +319,7 @@ def l15(res, req, resp):
 
 def l17(res, req, resp):
     "Last-Modified > If-Modified-Since?"
-    resp.last_modified = res.last_modified(req, resp)
+    resp.last_modified = callback(res, "last_modified", req, resp)
     if not (req.if_modified_since and resp.last_modified):
         return True
     return resp.last_modified > req.if_modified_since
@@ -249,7 +330,7 @@ def m05(res, req, resp):
 
 def m07(res, req, resp):
     "Server permits POST to missing resource?"
-    return res.allow_missing_post(req, resp)
+    return callback(res, "allow_missing_post", req, resp)
 
 def m16(res, req, resp):
     "DELETE?"
@@ -258,25 +339,25 @@ def m16(res, req, resp):
 def m20(res, req, resp):
     """Delete enacted immediayly?
     Also where DELETE is forced."""
-    return res.delete_resource(req, resp)
+    return callback(res, "delete_resource", req, resp)
 
 def m20b(res, req, resp):
     """ Delete completed """
-    return res.delete_completed(req, resp)
+    return callback(res, "delete_completed", req, resp)
 
 def n05(res, req, resp):
     "Server permits POST to missing resource?"
-    return res.allow_missing_post(req, resp)
+    return callback(res, "allow_missing_post", req, resp)
 
 def n11(res, req, resp):
     "Redirect?"
-    if res.post_is_create(req, resp):
+    if callback(res, "post_is_create", req, resp):
         handle_request_body(res, req, resp)
     else:
-        if not res.process_post(req, resp):
+        if not callback(res, "process_post", req, resp):
             raise webmachine.exc.HTTPInternalServerError("Failed to process POST.")
         return False
-    resp.location = res.created_location(req, resp)
+    resp.location = callback(res, "created_location", req, resp)
     if resp.location:
         return True     
     return False
@@ -288,8 +369,8 @@ def n16(res, req, resp):
 
 def o14(res, req, resp):
     "Is conflict?"
-    if not res.is_conflict(req, resp):
-        handle_response_body(res, req, resp)
+    if not callback(res, "is_conflict", req, resp):
+        handle_request_body(res, req, resp)
         return False
     return True
 
@@ -299,11 +380,41 @@ def o16(res, req, resp):
 
 def o18(res, req, resp):
     "Multiple representations? (Build GET/HEAD body)"
-    if req.method not in ["GET", "HEAD"]:
-        return res.multiple_choices(req, resp)
+    if req.method == "GET":
+        handle_response_body(res, req, resp)
+    elif req.method == "HEAD":
+        if res.head_runs_handler:
+            handle_response_body(res, req, resp)
+            drop_body(resp)
+        else:
+            handle_response_head(res, req, resp)
+    return callback(res, "multiple_choices", req, resp)
+
+def o18a(res, req, resp):
+    "Range not satisfiable?"
+    units = callback(res, "ranges_provided", req, resp)
+    if units:
+        resp['Accept-Ranges'] = ", ".join(units)
+    if requested_range(res, req, resp) is not False:
+        return False
+    resp['Content-Range'] = "bytes */%s" % ranged_body(resp)[1]
+    set_body(resp, "", None)
+    return True
 
-    handle_response_body(res, req, resp)
-    return res.multiple_choices(req, resp)
+def o18b(res, req, resp):
+    "Partial content?"
+    byte_range = requested_range(res, req, resp)
+    if not byte_range:
+        return False
+    (start, stop) = byte_range
+    (body, size) = ranged_body(resp)
+    if isinstance(body, str):
+        resp._container = [body[start:stop]]
+    else:
+        resp._container = body.slice(start, stop)
+    resp['Content-Range'] = str(ContentRange(start, stop, size))
+    resp['Content-Length'] = str(stop - start)
+    return True
 
 def o20(res, req, resp):
     "Response includes entity?"
@@ -311,7 +422,7 @@ def o20(res, req, resp):
 
 def p03(res, req, resp):
     "Conflict?"
-    if res.is_conflict(req, resp):
+    if callback(res, "is_conflict", req, resp):
         return True
 
     handle_request_body(res, req, resp)
@@ -324,7 +435,18 @@ def p11(res, req, resp):
     return True
 
 def first_match(func, req, resp, expect):
-    for (key, value) in func(req, resp):
+    return find_match(func(req, resp), expect)
+
+def media_types(pairs):
+    """ return the keys of (Key, Value) pairs """
+    if isinstance(pairs, MediaTable):
+        return pairs.types
+    return [key for (key, value) in (pairs or [])]
+
+def find_match(pairs, expect):
+    if isinstance(pairs, MediaTable):
+        return pairs.lookup.get(expect)
+    for (key, value) in (pairs or []):
         if key == expect:
             return value
     return None
@@ -333,45 +455,241 @@ def handle_request_body(res, req, resp):
     ctype = req.content_type or "application/octet-stream"
     mtype = ctype.split(";", 1)[0]
 
-    func = first_match(res.content_types_accepted, req, resp, mtype)
+    func = find_match(callback(res, "content_types_accepted", req, resp),
+            mtype)
     if func is None:
         raise webmachine.exc.HTTPUnsupportedMediaType()
     func(req, resp)
 
+def set_validators(res, req, resp):
+    resp.etag = callback(res, "generate_etag", req, resp)
+    resp.last_modified = callback(res, "last_modified", req, resp)
+    resp.expires = callback(res, "expires", req, resp)
+
+def handle_response_head(res, req, resp):
+    """ set the headers of a GET response without running the
+    content handler and the encoders """
+    set_validators(res, req, resp)
+
+    cache = res.representation_cache
+    if cache is not None and resp.etag is not None:
+        cached = cache.get(cache.key(res, req, resp))
+        if cached is not None:
+            (body, encoding, headers) = cached
+            replay_headers(resp, headers)
+            set_body(resp, body, encoding)
+            resp._container = [""]
+            return
+
+    length = callback(res, "content_length", req, resp)
+    encode = False
+    encoding = resp.wm_encoding
+    if encoding and encoding != "identity":
+        func = find_match(callback(res, "encodings_provided", req, resp),
+                encoding)
+        if func is None:
+            raise webmachine.exc.HTTPInternalServerError()
+        if getattr(func, "should_encode", None) is None:
+            encode = True
+        else:
+            # None when the GET body would decide
+            should_encode_size = getattr(func, "should_encode_size", None)
+            encode = should_encode_size and should_encode_size(resp,
+                    length)
+
+    if encode:
+        # the length of the encoded body isn't known
+        resp['Content-Encoding'] = encoding
+    else:
+        resp.content_encoding = None
+        if encode is False and length is not None:
+            resp['Content-Length'] = str(length)
+    resp._container = [""]
+    resp._is_string = True
+
 def handle_response_body(res, req, resp):
-    resp.etag = res.generate_etag(req, resp)
-    resp.last_modified = res.last_modified(req, resp)
-    resp.expires = res.expires(req, resp)
-    
+    set_validators(res, req, resp)
+
+    # Reuse the representation cached for this variant and etag
+    cache = res.representation_cache
+    cache_key = None
+    if cache is not None and resp.etag is not None:
+        cache_key = cache.key(res, req, resp)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            (body, encoding, headers) = cached
+            replay_headers(resp, headers)
+            set_body(resp, body, encoding)
+            return
+        before = dict(resp._headers)
+
     # Generate the body
-    func = first_match(res.content_types_provided, req, resp, resp.content_type)
+    func = find_match(callback(res, "content_types_provided", req, resp),
+            resp.content_type)
     if func is None:
         raise webmachine.exc.HTTPInternalServerError()
   
-    body = func(req, resp)
+    if res.metrics is None:
+        body = func(req, resp)
+    else:
+        body = res.metrics.timed(res, "body", func, req, resp)
 
     if not resp.content_type:
         resp.content_type = "text/plain" 
 
     # Handle our content encoding.
-    encoding = resp.content_encoding
-    if encoding:
-        func = first_match(res.encodings_provided, req, resp, encoding)
+    encoding = resp.wm_encoding
+    if encoding and encoding != "identity":
+        func = find_match(callback(res, "encodings_provided", req, resp),
+                encoding)
         if func is None:
             raise webmachine.exc.HTTPInternalServerError()
-        resp.body = func(resp.body)
+        should_encode = getattr(func, "should_encode", None)
+        if should_encode is None or should_encode(resp, body):
+            if res.metrics is None:
+                body = encode_body(func, body, resp._charset)
+            else:
+                body = res.metrics.timed(res, "encoding", encode_body,
+                        func, body, resp._charset)
+        else:
+            encoding = None
+
+    cached = cache_key is not None and isinstance(body, basestring)
+    if cached:
+        # a hit sends the same encoded body
+        body = smart_str(body, resp._charset)
+    set_body(resp, body, encoding)
+    if cached:
+        cache.set(cache_key, (body, encoding, changed_headers(before,
+            resp)))
+
+# headers set from the body by set_body
+BODY_HEADERS = ("content-length", "content-encoding")
+
+def changed_headers(before, resp):
+    """ return the headers changed since ``before`` as (Key, Header)
+    pairs, Header is None for the removed ones """
+    changed = []
+    for key, header in resp._headers.iteritems():
+        if key not in BODY_HEADERS and before.get(key) != header:
+            changed.append((key, header))
+    for key in before:
+        if key not in resp._headers and key not in BODY_HEADERS:
+            changed.append((key, None))
+    return changed
+
+def replay_headers(resp, headers):
+    """ apply the headers returned by ``changed_headers`` """
+    for key, header in headers:
+        if header is None:
+            resp._headers.pop(key, None)
+        else:
+            resp._headers[key] = header
+
+def drop_body(resp):
+    """ remove the body built for a HEAD response, keeping its
+    headers """
+    if hasattr(resp._container, "close"):
+        resp._container.close()
+    resp._container = [""]
+    resp._is_string = True
+
+def ranged_body(resp):
+    """ return the (Body, Size) of a response body whose parts can be
+    sent, (None, None) otherwise """
+    if resp._is_string:
+        if len(resp._container) == 1 and \
+                isinstance(resp._container[0], str):
+            return resp._container[0], len(resp._container[0])
+    elif hasattr(resp._container, "slice"):
+        return resp._container, resp._container.size
+    return None, None
+
+def requested_range(res, req, resp):
+    """ return the (start, stop) bytes requested by a single range
+    Range header, False if they can't be sent and None when the whole
+    body is sent """
+    if req.method != "GET" or "HTTP_RANGE" not in req.META:
+        return None
+    if "bytes" not in (callback(res, "ranges_provided", req, resp) or []):
+        return None
+    (body, size) = ranged_body(resp)
+    if body is None:
+        return None
+    if "HTTP_IF_RANGE" in req.META and not req.if_range.match(
+            etag=resp.etag, last_modified=resp.last_modified):
+        # the representation changed, send it all
+        return None
+
+    byte_range = req.range
+    if byte_range is None or len(byte_range.ranges) != 1:
+        # malformed or several ranges, send the whole body
+        return None
+    # clamped to the body size, None if the range starts after its end
+    return byte_range.range_for_length(size) or False
+
+def set_body(resp, body, encoding):
+    if encoding and encoding != "identity":
         resp['Content-Encoding'] = encoding
+    else:
+        resp.content_encoding = None
 
     if not isinstance(body, basestring) and hasattr(body, '__iter__'):
         resp._container = body
         resp._is_string = False
+        if hasattr(body, "slice"):
+            # file bodies know their size
+            resp['Content-Length'] = str(body.size)
     else:
         resp._container = [body]
         resp._is_string = True
+        if isinstance(body, str):
+            # cheap enough, don't compute it for unicode or iterables
+            resp['Content-Length'] = str(len(body))
+
+def encode_chunks(body, charset):
+    for chunk in body:
+        yield smart_str(chunk, charset)
+
+class ClosingIterator(object):
+    """ iterate over an encoded body and close its source with it """
+
+    def __init__(self, iterable, source):
+        self.iterable = iterable
+        self.source = source
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, "close"):
+                self.iterable.close()
+        finally:
+            self.source.close()
+
+def encode_body(func, body, charset):
+    """ apply a content encoder to the body. Encoders with an
+    ``encode_stream`` method encode iterables chunk by chunk, other
+    encoders are called with the whole body. """
+    if isinstance(body, basestring):
+        return func(smart_str(body, charset))
+    elif hasattr(func, "encode_stream"):
+        encoded = func.encode_stream(encode_chunks(body, charset))
+        if hasattr(body, "close"):
+            # the server only closes the encoded body
+            encoded = ClosingIterator(encoded, body)
+        return encoded
+
+    try:
+        return func("".join(encode_chunks(body, charset)))
+    finally:
+        if hasattr(body, "close"):
+            body.close()
 
 
 TRANSITIONS = {
-    b03: (200, c03), # Options?
+    b03: (200, c01), # Options?
     b04: (413, b03), # Request entity too large?
     b05: (415, b04), # Unknown Content-Type?
     b06: (501, b05), # Unknown or unsupported Content-* header?
@@ -382,6 +700,8 @@ TRANSITIONS = {
     b11: (414, b10), # URI too long?
     b12: (b11, 501), # Known method?
     b13: (b12, 503), # Service available?
+    c01: (412, c02), # Precondition failed on validators?
+    c02: (304, c03), # Not modified on validators?
     c03: (c04, d04), # Accept exists?
     c04: (d04, 406), # Acceptable media type available?
     d04: (d05, e05), # Accept-Language exists?
@@ -423,8 +743,91 @@ TRANSITIONS = {
     n16: (n11, o16), # POST?
     o14: (409, p11), # Conflict?
     o16: (o14, o18), # PUT?
-    o18: (300, 200), # Multiple representations?
+    o18: (300, o18a), # Multiple representations?
+    o18a: (416, o18b), # Range not satisfiable?
+    o18b: (206, 200), # Partial content?
     o20: (o18, 204), # Response includes entity?
     p03: (409, p11), # Conflict?
     p11: (201, o20)  # New resource?
 }
+
+# Decisions that only depend on resource callbacks. When none of the
+# callbacks has been overridden the outcome is the one given here, so
+# the decision can be folded away when the flow is compiled.
+CONSTANT_DECISIONS = {
+    b04: (("valid_entity_length",), False),
+    b05: (("known_content_type",), False),
+    b06: (("valid_content_headers",), False),
+    b07: (("forbidden",), False),
+    b08: (("is_authorized",), True),
+    b09: (("malformed_request",), False),
+    b11: (("uri_too_long",), False),
+    b13: (("ping", "service_available"), True),
+    c01: (("validators",), False),
+    c02: (("validators",), False),
+    d05: (("languages_provided",), True),
+    e06: (("charsets_provided",), True),
+    f07: (("encodings_provided",), True),
+    i04: (("moved_permanently",), False),
+    k05: (("moved_permanently",), False),
+    k07: (("previously_existed",), False),
+    l05: (("moved_temporarily",), False),
+    m07: (("allow_missing_post",), False),
+    n05: (("allow_missing_post",), False),
+    o18a: (("ranges_provided",), False),
+    o18b: (("ranges_provided",), False)
+}
+
+# Decisions without side effects, they can be dropped when both of
+# their branches lead to the same state.
+PURE_DECISIONS = (c03, d04, e05, f06, g08, h10, i12, l07, l13, m05,
+        m16, n16, o16)
+
+def compile_flow(overridden, transitions=None, start=b13):
+    """ compile the decision graph for a resource.
+
+    :attr overridden: names of the resource callbacks that differ
+    from the defaults.
+
+    Decisions whose result is known in advance are folded and the
+    remaining ones are linked directly to their next live state.
+    Return a ``(start, transitions)`` tuple. """
+    if transitions is None:
+        transitions = TRANSITIONS
+
+    folded = {}
+    for state, (callbacks, outcome) in CONSTANT_DECISIONS.items():
+        if state in transitions and not overridden.intersection(callbacks):
+            folded[state] = transitions[state][not outcome and 1 or 0]
+
+    def resolve(state):
+        seen = set()
+        while state in folded:
+            if state in seen:
+                raise ValueError("Loop in decision graph: %r" % state)
+            seen.add(state)
+            state = folded[state]
+        return state
+
+    changed = True
+    while changed:
+        changed = False
+        for state in PURE_DECISIONS:
+            if state in folded or state not in transitions:
+                continue
+            (if_true, if_false) = transitions[state]
+            if resolve(if_true) == resolve(if_false):
+                folded[state] = if_true
+                changed = True
+
+    flow = {}
+    for state, branches in transitions.items():
+        if state in folded:
+            continue
+        flow[state] = tuple([resolve(s) for s in branches])
+
+    for branches in flow.values():
+        for s in branches:
+            if not isinstance(s, int) and s not in flow:
+                raise ValueError("Invalid state: %r" % s)
+    return resolve(start), flow
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -
+#
+# This file is part of dj-webmachine released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Radix tree dispatching of the WM routes. Rather than letting Django
+try each route regexp in turn, the literal prefix of each pattern is
+inserted in a radix tree. A path only walks the tree, then the regexps
+of the routes whose prefix matched are tried in registration order.
+Fully static patterns are compared without regexp.
+
+Mount it in urls.py with::
+
+    urlpatterns = patterns('',
+        (r'^api/', include(webmachine.wm.dispatch_urls))
+    )
+
+Routes are no longer known by the Django resolver, so ``reverse`` can't
+find them unless ``wm.urls`` is also included.
+"""
+
+import re
+import sre_parse
+from sre_constants import AT, AT_BEGINNING, AT_END, LITERAL
+
+from django.core.urlresolvers import Resolver404
+from django.http import Http404
+
+
+def literal_prefix(pattern):
+    """ return (Prefix, Static). Prefix is the literal string any path
+    matched by the regexp ``pattern`` starts with. Static is True if the
+    pattern only matches Prefix. """
+    parsed = sre_parse.parse(pattern)
+    if parsed.pattern.flags & re.IGNORECASE:
+        return u"", False
+
+    items = list(parsed)
+    if not items or items[0] != (AT, AT_BEGINNING):
+        # not anchored, it can match anywhere
+        return u"", False
+
+    prefix = []
+    for op, av in items[1:]:
+        if op != LITERAL:
+            break
+        prefix.append(unichr(av))
+    static = items[len(prefix) + 1:] == [(AT, AT_END)]
+    return u"".join(prefix), static
+
+
+class Node(object):
+    __slots__ = ("label", "children", "values")
+
+    def __init__(self, label=u""):
+        self.label = label
+        self.children = {}
+        self.values = []
+
+
+class RadixTree(object):
+    """ a compressed prefix tree. Several values can be stored under
+    the same key. """
+
+    def __init__(self):
+        self.root = Node()
+
+    def insert(self, key, value):
+        node = self.root
+        while key:
+            child = node.children.get(key[0])
+            if child is None:
+                child = Node(key)
+                node.children[key[0]] = child
+                node = child
+                break
+
+            label = child.label
+            n = 0
+            size = min(len(label), len(key))
+            while n < size and label[n] == key[n]:
+                n += 1
+
+            if n < len(label):
+                # split the edge at the common prefix
+                parent = Node(label[:n])
+                child.label = label[n:]
+                parent.children[child.label[0]] = child
+                node.children[key[0]] = parent
+                child = parent
+            node = child
+            key = key[n:]
+        node.values.append(value)
+
+    def prefixes(self, path):
+        """ iterate over the values stored under the keys ``path``
+        starts with, shortest keys first """
+        node = self.root
+        pos = 0
+        while True:
+            for value in node.values:
+                yield value
+            node = node.children.get(path[pos:pos + 1])
+            if node is None or not path.startswith(node.label, pos):
+                return
+            pos += len(node.label)
+
+
+class Dispatcher(object):
+    """ a Django view dispatching the requests to the routes of a
+    :class:`webmachine.route.WM` instance. The tree is rebuilt when
+    routes are added. """
+
+    def __init__(self, wm):
+        self.wm = wm
+        self._tree = None
+        self._revision = None
+
+    @property
+    def tree(self):
+        if self._tree is None or self._revision != self.wm.revision:
+            self._revision = self.wm.revision
+            self._tree = self.build()
+        return self._tree
+
+    def build(self):
+        tree = RadixTree()
+        for order, entry in enumerate(self.wm.get_urls()):
+            prefix, static = literal_prefix(entry.regex.pattern)
+            tree.insert(prefix, (order, static, prefix, entry))
+        return tree
+
+    def resolve(self, path):
+        """ return the (View, Args, Kwargs) handling ``path`` or None """
+        for order, static, prefix, entry in sorted(self.tree.prefixes(path)):
+            if static:
+                if path == prefix:
+                    return entry.callback, (), entry.default_args
+                continue
+
+            try:
+                match = entry.resolve(path)
+            except Resolver404:
+                continue
+            if match is not None:
+                return match.func, match.args, match.kwargs
+        return None
+
+    def __call__(self, request, wm_path=u""):
+        match = self.resolve(wm_path)
+        if match is None:
+            raise Http404
+        view, args, kwargs = match
+        return view(request, *args, **kwargs)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -
+#
+# This file is part of dj-webmachine released under the MIT license. 
+# See the NOTICE for more information.
+
+"""
+Content encoders to use in ``encodings_provided``:
+
+.. code-block:: python
+
+    from webmachine import Resource
+    from webmachine.helpers.encoders import default_encodings
+
+    ENCODINGS = default_encodings()
+
+    class MyResource(Resource):
+
+        def encodings_provided(self, req, resp):
+            return ENCODINGS
+
+Encoders compress iterable bodies chunk by chunk. Bodies smaller than
+``min_size`` and media types already compressed are sent unencoded.
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+__all__ = ['identity', 'GzipEncoder', 'DeflateEncoder', 'BrotliEncoder',
+'default_encodings']
+
+# media types not worth compressing
+COMPRESSED_TYPES = ("image/png", "image/jpeg", "image/gif", "image/webp",
+"audio/", "video/", "application/zip", "application/gzip",
+"application/x-gzip", "application/x-bzip2", "application/x-xz",
+"application/x-7z-compressed", "application/x-rar-compressed")
+
+def identity(body):
+    return body
+
+
+class Encoder(object):
+
+    def __init__(self, level=6, min_size=256, skip_types=COMPRESSED_TYPES):
+        """
+        :attr level: compression level
+        :attr min_size: bodies smaller than this size in bytes aren't
+        encoded
+        :attr skip_types: prefixes of the media types which aren't
+        encoded
+        """
+        self.level = level
+        self.min_size = min_size
+        self.skip_types = tuple(skip_types)
+
+    def compressor(self):
+        """ return an object with the ``compress`` and ``flush``
+        methods of zlib compression objects. """
+        raise NotImplementedError
+
+    def should_encode(self, resp, body):
+        ctype = resp.content_type or ""
+        if ctype.startswith(self.skip_types):
+            return False
+        if isinstance(body, basestring):
+            return len(body) >= self.min_size
+        return True
+
+    def should_encode_size(self, resp, size):
+        """ tell, without the body, if a body of ``size`` bytes is
+        encoded. None when it depends on the body. """
+        ctype = resp.content_type or ""
+        if ctype.startswith(self.skip_types):
+            return False
+        if size is not None and size >= self.min_size:
+            return True
+        # small iterable bodies are encoded, small strings aren't
+        return None
+
+    def __call__(self, body):
+        c = self.compressor()
+        return c.compress(body) + c.flush()
+
+    def encode_stream(self, chunks):
+        c = self.compressor()
+        for chunk in chunks:
+            data = c.compress(chunk)
+            if data:
+                yield data
+        yield c.flush()
+
+
+class GzipEncoder(Encoder):
+
+    def compressor(self):
+        # 16 + MAX_WBITS adds the gzip header and trailer
+        return zlib.compressobj(self.level, zlib.DEFLATED,
+                16 + zlib.MAX_WBITS)
+
+
+class DeflateEncoder(Encoder):
+    """ the HTTP deflate encoding: zlib stream format """
+
+    def compressor(self):
+        return zlib.compressobj(self.level)
+
+
+class _BrotliCompressor(object):
+
+    def __init__(self, quality):
+        self.c = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.c.process(data)
+
+    def flush(self):
+        return self.c.finish()
+
+class BrotliEncoder(Encoder):
+    """ require the brotli module """
+
+    def __init__(self, level=5, **kwargs):
+        if brotli is None:
+            raise ImportError("brotli module is not installed")
+        super(BrotliEncoder, self).__init__(level=level, **kwargs)
+
+    def compressor(self):
+        return _BrotliCompressor(self.level)
+
+
+def default_encodings(level=6, min_size=256):
+    """ return the list of (Encoding, Encoder) pairs supported,
+    ordered by preference. br is only provided when brotli is
+    installed. """
+    encodings = [
+        ("gzip", GzipEncoder(level=level, min_size=min_size)),
+        ("deflate", DeflateEncoder(level=level, min_size=min_size)),
+        ("identity", identity)
+    ]
+    if brotli is not None:
+        encodings.insert(0, ("br", BrotliEncoder(min_size=min_size)))
+    return encodings
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -
+#
+# This file is part of dj-webmachine released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+File bodies. A content handler returning a :class:`FileBody` sends the
+file without reading it in memory. When ``ranges_provided`` returns
+``["bytes"]``, Range requests only read the requested part of the file:
+
+.. code-block:: python
+
+    from webmachine import Resource
+    from webmachine.helpers.files import FileBody
+
+    class Report(Resource):
+
+        def ranges_provided(self, req, resp):
+            return ["bytes"]
+
+        def content_types_provided(self, req, resp):
+            return [("text/csv", self.to_csv)]
+
+        def to_csv(self, req, resp):
+            return FileBody("/var/reports/%s.csv" % req.url_kwargs["id"])
+"""
+
+import mmap
+import os
+
+__all__ = ['FileBody']
+
+def file_size(f):
+    try:
+        return os.fstat(f.fileno()).st_size
+    except (AttributeError, EnvironmentError):
+        f.seek(0, 2)
+        return f.tell()
+
+
+class FileBody(object):
+    """ iterate over the bytes from ``start`` to ``stop`` of a file.
+    Regular files are read through mmap, other file objects with seek
+    and read. """
+
+    def __init__(self, f, start=0, stop=None, chunk_size=65536,
+            use_mmap=True):
+        """
+        :attr f: path or file object opened in binary mode
+        :attr start: offset of the first byte sent
+        :attr stop: offset after the last byte sent, the end of the file
+        by default
+        """
+        if isinstance(f, basestring):
+            f = open(f, "rb")
+        self.file = f
+        length = file_size(f)
+        self.start = min(start, length)
+        if stop is None:
+            self.stop = length
+        else:
+            self.stop = max(self.start, min(stop, length))
+        self.chunk_size = chunk_size
+        self.use_mmap = use_mmap
+
+    @property
+    def size(self):
+        return self.stop - self.start
+
+    def slice(self, start, stop):
+        """ return the body of the bytes from ``start`` to ``stop`` of
+        this body """
+        return FileBody(self.file, self.start + start,
+                min(self.start + stop, self.stop),
+                chunk_size=self.chunk_size, use_mmap=self.use_mmap)
+
+    def _map(self):
+        if not self.use_mmap or not self.size:
+            return None
+        try:
+            return mmap.mmap(self.file.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError):
+            return None
+
+    def __iter__(self):
+        data = self._map()
+        if data is not None:
+            try:
+                for pos in xrange(self.start, self.stop, self.chunk_size):
+                    yield data[pos:min(pos + self.chunk_size, self.stop)]
+            finally:
+                data.close()
+            return
+
+        self.file.seek(self.start)
+        remaining = self.size
+        while remaining > 0:
+            chunk = self.file.read(min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.file.close()
@@ -3,14 +3,21 @@
 # This file is part of dj-webmachine released under the MIT license. 
 # See the NOTICE for more information.
 
+import csv
 import decimal
 import datetime
+import inspect
 import re
 import time
+from itertools import islice
 
-from django.db.models import Model
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.models import Manager, Model
 from django.db.models.query import QuerySet
-from django.utils.encoding import smart_unicode
+from django.utils.encoding import smart_str, smart_unicode
 
 
 re_date = re.compile('^(\d{4})\D?(0[1-9]|1[0-2])\D?([12]\d|0[1-9]|3[01])$')
@@ -19,8 +26,9 @@ re_datetime = re.compile('^(\d{4})\D?(0[1-9]|1[0-2])\D?([12]\d|0[1-9]|3[01])(\D?
 re_decimal = re.compile('^(\d+)\.(\d+)$')
 
 
-__all__ = ['Serializer', 'JSONSerializer', 'value_to_emittable',
-'value_to_python']
+__all__ = ['Serializer', 'JSONSerializer', 'StreamingJSONSerializer',
+'NDJSONSerializer', 'CSVSerializer', 'value_to_emittable',
+'value_to_python', 'register_emitter', 'Schema']
 
 try:
     import json
@@ -35,9 +43,19 @@ except ImportError:
 
 class Serializer(object):
 
-    def __init__(self, fields=None, exclude=None):
+    def __init__(self, fields=None, exclude=None, schema=None):
+        """
+        :attr fields: names of the model fields serialized
+        :attr exclude: names of the model fields not serialized
+        :attr schema: how the unserialized values are converted, a
+        :class:`Schema`, a dict {FieldName: Type or Converter}, a model
+        or a form class. Without a schema the types are guessed.
+        """
         self.fields = fields
         self.exclude = exclude
+        if schema is not None:
+            schema = get_schema(schema)
+        self.schema = schema
 
     def _to_string(self, value):
         return value
@@ -50,21 +68,270 @@ class Serializer(object):
                 exclude=self.exclude)
         return self._to_string(value)
 
+    def to_python(self, value):
+        """ convert an unserialized value """
+        if self.schema is None:
+            return value_to_python(value)
+        return self.schema.to_python(value)
+
     def unserialize(self, value):
         if isinstance(value, basestring):
             value = StringIO.StringIO(value)
 
-        return value_to_python(self._to_python(value))
+        return self.to_python(self._to_python(value))
+
+class JSONBackend(object):
+    """ a JSON library. Native backends call a ``default`` hook for
+    the values they can't encode, so dates, decimals or models are only
+    converted when met instead of walking the whole value first. """
+
+    def __init__(self, module, native=True, **options):
+        self.module = module
+        self.name = module.__name__
+        self.native = native
+        self.options = options
+
+    def encoder(self, default=None):
+        """ return a function encoding a value to a str """
+        if not self.native:
+            return self.module.dumps
+        return self.module.JSONEncoder(default=default,
+                **self.options).encode
+
+    def loads(self, value):
+        return self.module.loads(value)
+
+# backends tried in order when WEBMACHINE_JSON_BACKEND isn't set. ujson
+# floats and escaping differ, it's only used when set explicitly.
+JSON_BACKENDS = ("simplejson", "json")
+
+_json_backends = {}
+
+def load_json_backend(name):
+    if name not in JSON_BACKENDS + ("ujson",):
+        raise ImproperlyConfigured("unknown JSON backend %r" % name)
+    elif name == "json":
+        return JSONBackend(json)
+
+    module = __import__(name)
+    if name == "ujson":
+        # no default hook, values are converted first
+        return JSONBackend(module, native=False)
+    # keep decimals encoded as strings
+    return JSONBackend(module, use_decimal=False)
+
+def get_json_backend(name=None):
+    """ return the :class:`JSONBackend` ``name``, by default the one
+    set in the ``WEBMACHINE_JSON_BACKEND`` setting or the first one
+    installed in ``JSON_BACKENDS``. """
+    if name is None:
+        name = getattr(settings, 'WEBMACHINE_JSON_BACKEND', None)
+    try:
+        return _json_backends[name]
+    except KeyError:
+        pass
+
+    if name is None:
+        for candidate in JSON_BACKENDS:
+            try:
+                backend = load_json_backend(candidate)
+                break
+            except ImportError:
+                continue
+    else:
+        try:
+            backend = load_json_backend(name)
+        except ImportError:
+            raise ImproperlyConfigured("JSON backend %r isn't installed" %
+                    name)
+    _json_backends[name] = backend
+    return backend
 
 class JSONSerializer(Serializer):
+    """ JSON serializer. The JSON library used is given by ``backend``,
+    see :func:`get_json_backend`. """
+
+    def __init__(self, fields=None, exclude=None, schema=None,
+            backend=None):
+        super(JSONSerializer, self).__init__(fields=fields,
+                exclude=exclude, schema=schema)
+        self.backend = backend
+        self._json_backend = None
+        self._encoder = None
+
+    @property
+    def json_backend(self):
+        if self._json_backend is None:
+            self._json_backend = get_json_backend(self.backend)
+        return self._json_backend
+
+    def _default(self, value):
+        return value_to_emittable(value, fields=self.fields,
+                exclude=self.exclude)
+
+    def encoder(self):
+        """ return the function encoding emittable values """
+        if self._encoder is None:
+            self._encoder = self.json_backend.encoder(default=self._default)
+        return self._encoder
+
+    def encode(self, value):
+        """ encode any value to JSON """
+        if not self.json_backend.native:
+            value = value_to_emittable(value, fields=self.fields,
+                    exclude=self.exclude)
+        return self.encoder()(value)
+
+    def _to_string(self, value):
+        return self.encoder()(value)
+
+    def _to_python(self, value):
+        if not isinstance(value, basestring):
+            value = value.read()
+        return self.json_backend.loads(value)
+
+    def serialize(self, value):
+        return self.encode(value)
+
+    def unserialize(self, value):
+        return self.to_python(self._to_python(value))
+
+    def serialize_stream(self, value):
+        """ serialize an iterable to a JSON array, one element at a
+        time. """
+        yield "["
+        sep = ""
+        for item in value:
+            yield sep + self.encode(item)
+            sep = ","
+        yield "]"
+
+class StreamingJSONSerializer(JSONSerializer):
+    """ serialize QuerySets to a JSON array without loading them in
+    memory. Rows are read with ``QuerySet.iterator()`` and serialized
+    ``chunk_size`` at a time, other values are serialized like
+    :class:`JSONSerializer` does. It can be given to the ``provided``
+    argument of a route or called from a content handler:
+
+    .. code-block:: python
+
+        ITEMS = StreamingJSONSerializer(fields=("name", "price"))
+
+        @wm.route(r"^items$", provided=[("application/json", ITEMS)])
+        def items(req, resp):
+            return Item.objects.all()
+
+    The rows are read while the server sends the body, after Django
+    closed the database connection at the end of the request. The
+    connection opened then is closed with the body, outside of the
+    request transaction management.
+    """
+
+    def __init__(self, fields=None, exclude=None, schema=None,
+            backend=None, chunk_size=500):
+        super(StreamingJSONSerializer, self).__init__(fields=fields,
+                exclude=exclude, schema=schema, backend=backend)
+        self.chunk_size = chunk_size
+
+    def serialize(self, value):
+        if isinstance(value, QuerySet):
+            return self.serialize_queryset(value)
+        return super(StreamingJSONSerializer, self).serialize(value)
+
+    def serialize_queryset(self, qs):
+        """ yield the JSON array of a QuerySet, one chunk of rows at a
+        time """
+        connection = connections[qs.db]
+        # closed by request_finished when the server iterates the body
+        reopened = connection.connection is None
+        try:
+            for data in self._serialize_queryset(qs):
+                yield data
+        finally:
+            if reopened:
+                connection.close()
+
+    def _serialize_queryset(self, qs):
+        plan = None
+        if yields_models(qs):
+            plan = model_plan(qs.model, fields=self.fields,
+                    exclude=self.exclude)
+
+        if qs._result_cache is not None:
+            rows = iter(qs)
+        else:
+            if plan is not None and plan.related:
+                qs = with_related(qs, plan.related)
+            rows = qs.iterator()
+
+        yield "["
+        sep = ""
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            if plan is None:
+                values = [value_to_emittable(row, fields=self.fields,
+                    exclude=self.exclude) for row in chunk]
+            else:
+                plan.fetch_related(chunk)
+                m2m = plan.fetch_m2m(chunk)
+                values = [plan.emit(row, m2m) for row in chunk]
+            # encode the chunk as an array, without its brackets
+            yield sep + self._to_string(values)[1:-1]
+            sep = ","
+        yield "]"
+
+class NDJSONSerializer(Serializer):
+    """ newline delimited JSON, one value per line. The body is
+    unserialized lazily, line by line. """
 
     def _to_string(self, value):
+        if not isinstance(value, (list, tuple, QuerySet)):
+            # a single object or scalar is a single line
+            value = [value]
+        return "".join([json.dumps(v) + "\n" for v in value])
+
+    def serialize_stream(self, value):
+        for item in value:
+            yield json.dumps(value_to_emittable(item, fields=self.fields,
+                exclude=self.exclude)) + "\n"
+
+    def unserialize(self, value):
+        if isinstance(value, basestring):
+            value = StringIO.StringIO(value)
+        return list(self.unserialize_stream(value))
+
+    def unserialize_stream(self, stream):
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield self.to_python(json.loads(line))
+
+class CSVSerializer(Serializer):
+    """ CSV with a header line. Rows are unserialized lazily as dicts
+    keyed by the columns of the header. """
+
+    def _to_string(self, value):
+        if not value:
+            return ""
+        columns = self.fields or sorted(value[0].keys())
         stream = StringIO.StringIO()
-        json.dump(value, stream)
+        writer = csv.writer(stream)
+        writer.writerow(columns)
+        for row in value:
+            writer.writerow([unicode(row.get(c, "")).encode("utf-8") \
+                    for c in columns])
         return stream.getvalue()
 
-    def _to_python(self, value):
-        return json.load(value)
+    def unserialize(self, value):
+        if isinstance(value, basestring):
+            value = StringIO.StringIO(value)
+        return list(self.unserialize_stream(value))
+
+    def unserialize_stream(self, stream):
+        for row in csv.DictReader(stream):
+            yield self.to_python(row)
 
 
 
@@ -89,84 +356,294 @@ def m2m_to_emittable(value, field, fields=None, exclude=None):
     return [model_to_emittable(m, fields=fields, exclude=exclude) \
             for m in getattr(value, field.name).iterator() ]
 
+def yields_models(qs):
+    """ True if the rows of ``qs`` are instances of its model, not
+    the dicts, tuples or dates of values(), values_list() or dates() """
+    return getattr(type(qs).iterator, "im_func", None) is \
+            QuerySet.iterator.im_func
+
 def qs_to_emittable(value, fields=None, exclude=None):
-    return [value_to_emittable(v, fields=fields, exclude=exclude) for v in value]
+    if not yields_models(value):
+        return [value_to_emittable(v, fields=fields, exclude=exclude) \
+                for v in value]
+
+    plan = model_plan(value.model, fields=fields, exclude=exclude)
+    if plan.related and value._result_cache is None:
+        # fetch the foreign keys with the rows
+        value = with_related(value, plan.related)
+    instances = list(value)
+    # the ones select_related didn't follow
+    plan.fetch_related(instances)
+    m2m = plan.fetch_m2m(instances)
+    return [plan.emit(instance, m2m) for instance in instances]
+
+def with_related(qs, related):
+    """ add the ``related`` foreign keys to the ``select_related`` of
+    ``qs``, keeping the relations it already follows """
+    current = qs.query.select_related
+    if current is True:
+        # already follows all the non null foreign keys
+        return qs
+    qs = qs.select_related(*[f.name for f in related])
+    if current:
+        # select_related(*fields) replaces the previous fields
+        merged = dict(qs.query.select_related)
+        merged.update(current)
+        qs.query.select_related = merged
+    return qs
 
 def model_to_emittable(instance, fields=None, exclude=None):
-    meta = instance._meta
-    if not fields and not exclude:
-        ret = {}
-        for f in meta.fields:
-            ret[f.attname] = value_to_emittable(getattr(instance,
-                f.attname))
+    plan = model_plan(instance.__class__, fields=fields, exclude=exclude)
+    return plan.emit(instance)
 
-        fields = dir(instance.__class__) + ret.keys()
-        extra = [k for k in dir(instance) if k not in fields]
+# number of primary keys in a single IN query
+BATCH_SIZE = 500
 
-        for k in extra:
-            ret[k] = value_to_emittable(getattr(instance, k))
-    else:
-        fields_list = []
-        fields_iter = iter(meta.local_fields + meta.virtual_fields + meta.many_to_many)
-        # fields_iter = iter(meta.fields + meta.many_to_many)
-        for f in fields_iter:
-            value = None
+def db_of(instances):
+    """ the database the instances were read from """
+    for instance in instances:
+        return instance._state.db
+    return None
+
+class ModelPlan(object):
+    """ the fields of a model to serialize, computed once for a model,
+    fields and exclude. """
+
+    def __init__(self, model, fields=None, exclude=None):
+        meta = model._meta
+        self.fields = fields
+        self.exclude = exclude
+
+        if not fields and not exclude:
+            # all the fields, foreign keys as ids, and the attributes
+            # set on the instances
+            self.attnames = [f.attname for f in meta.fields]
+            self.class_attrs = frozenset(dir(model))
+            self.values = self.related = self.objects = self.m2m = ()
+            return
+
+        self.attnames = None
+        self.values = []
+        self.related = []
+        self.virtual = []
+        self.m2m = []
+        for f in meta.local_fields + meta.virtual_fields:
             if fields is not None and not f.name in fields:
                 continue
             if exclude is not None and f.name in exclude:
                 continue
-
-            if f in meta.many_to_many:
-                if f.serialize:
-                    value = m2m_to_emittable(instance, f, fields=fields,
-                            exclude=exclude)
+            if not getattr(f, "serialize", True):
+                continue
+            if f in meta.virtual_fields:
+                self.virtual.append(f.name)
+            elif f.rel is None:
+                self.values.append((f.name, f.attname))
             else:
-                if f.serialize:
-                    if not f.rel:
-                        value = value_to_emittable(getattr(instance,
-                            f.attname), fields=fields, exclude=exclude)
-                    else:
-                        value = fk_to_emittable(instance, f,
-                                fields=fields, exclude=exclude)
-
-            if value is None:
+                self.related.append(f)
+
+        for f in meta.many_to_many:
+            if fields is not None and not f.name in fields:
                 continue
+            if exclude is not None and f.name in exclude:
+                continue
+            if f.serialize:
+                self.m2m.append(f)
+
+        self.objects = [f.name for f in self.related] + self.virtual
 
-            fields_list.append((f.name, value))
+    def fetch_related(self, instances):
+        """ fetch the foreign keys of ``instances`` not yet loaded with
+        one query per field and batch of instances """
+        for f in self.related:
+            rel_model = f.rel.to
+            if f.rel.field_name != rel_model._meta.pk.name:
+                continue
+            cache_name = f.get_cache_name()
+            missing = [instance for instance in instances \
+                    if not hasattr(instance, cache_name)]
+            ids = list(set([getattr(instance, f.attname) \
+                    for instance in missing]) - set([None]))
+            related = {}
+            manager = rel_model._default_manager.using(db_of(instances))
+            for i in xrange(0, len(ids), BATCH_SIZE):
+                related.update(manager.in_bulk(ids[i:i + BATCH_SIZE]))
+            for instance in missing:
+                obj = related.get(getattr(instance, f.attname))
+                if obj is not None:
+                    setattr(instance, cache_name, obj)
+
+    def fetch_m2m(self, instances):
+        """ fetch the many to many relations of ``instances`` with one
+        query per field and batch of instances. Return a dict
+        {FieldName: {Pk: [RelatedInstance]}}. """
+        if not self.m2m or not instances:
+            return None
+
+        pks = [instance.pk for instance in instances]
+        db = db_of(instances)
+        fetched = {}
+        for f in self.m2m:
+            source = f.m2m_field_name()
+            target = f.m2m_reverse_field_name()
+            manager = f.rel.through._default_manager.using(db)
+
+            links = []
+            for i in xrange(0, len(pks), BATCH_SIZE):
+                links.extend(manager.filter(**{"%s__in" % source:
+                    pks[i:i + BATCH_SIZE]}).values_list(source, target))
+
+            # keep the default ordering of the related model
+            target_pks = list(set([t for s, t in links]))
+            position = {}
+            related = {}
+            rel_manager = f.rel.to._default_manager.using(db)
+            for i in xrange(0, len(target_pks), BATCH_SIZE):
+                for obj in rel_manager.filter(
+                        pk__in=target_pks[i:i + BATCH_SIZE]):
+                    position[obj.pk] = len(position)
+                    related[obj.pk] = obj
+
+            by_instance = {}
+            for s, t in links:
+                if t in related:
+                    by_instance.setdefault(s, []).append(related[t])
+            for objs in by_instance.values():
+                objs.sort(key=lambda obj: position[obj.pk])
+            fetched[f.name] = by_instance
+        return fetched
+
+    def emit(self, instance, m2m=None):
+        if self.attnames is not None:
+            ret = {}
+            for attname in self.attnames:
+                ret[attname] = value_to_emittable(getattr(instance, attname))
+            for k in instance.__dict__:
+                if k not in self.class_attrs and k not in ret:
+                    ret[k] = value_to_emittable(getattr(instance, k))
+            return ret
+
+        fields = self.fields
+        exclude = self.exclude
+        ret = {}
+        for name, attname in self.values:
+            value = value_to_emittable(getattr(instance, attname),
+                    fields=fields, exclude=exclude)
+            if value is not None:
+                ret[name] = value
+
+        for name in self.objects:
+            value = value_to_emittable(getattr(instance, name))
+            if value is not None:
+                ret[name] = value
+
+        for f in self.m2m:
+            if m2m is not None:
+                related = m2m[f.name].get(instance.pk, [])
+            else:
+                related = getattr(instance, f.name).iterator()
+            ret[f.name] = [model_to_emittable(obj, fields=fields,
+                exclude=exclude) for obj in related]
+        return ret
+
+_plans = {}
+
+def model_plan(model, fields=None, exclude=None):
+    """ return the cached :class:`ModelPlan` of a model """
+    if fields is not None:
+        fields = tuple(fields)
+    if exclude is not None:
+        exclude = tuple(exclude)
+    key = (model, fields, exclude)
+    try:
+        return _plans[key]
+    except KeyError:
+        plan = _plans[key] = ModelPlan(model, fields=fields,
+                exclude=exclude)
+        return plan
+
+def datetime_to_emittable(value, fields=None, exclude=None):
+    return value.replace(microsecond=0).isoformat() + 'Z'
+
+def date_to_emittable(value, fields=None, exclude=None):
+    return value.isoformat()
+
+def time_to_emittable(value, fields=None, exclude=None):
+    return value.replace(microsecond=0).isoformat()
+
+def decimal_to_emittable(value, fields=None, exclude=None):
+    return str(value)
+
+def manager_to_emittable(value, fields=None, exclude=None):
+    if hasattr(value, "core_filters"):
+        # related managers are bound to an instance
+        return relm_to_emittable(value)
+    return smart_unicode(value, strings_only=True)
+
+def unicode_to_emittable(value, fields=None, exclude=None):
+    return smart_unicode(value, strings_only=True)
+
+def same_emittable(value, fields=None, exclude=None):
+    return value
 
-        ret = dict(fields_list)
-    return ret
+# converters by type, see register_emitter
+EMITTERS = {
+    QuerySet: qs_to_emittable,
+    datetime.datetime: datetime_to_emittable,
+    datetime.date: date_to_emittable,
+    datetime.time: time_to_emittable,
+    decimal.Decimal: decimal_to_emittable,
+    list: list_to_emittable,
+    tuple: list_to_emittable,
+    set: list_to_emittable,
+    frozenset: list_to_emittable,
+    dict: dict_to_emittable,
+    Model: model_to_emittable,
+    Manager: manager_to_emittable,
+    str: unicode_to_emittable,
+    unicode: same_emittable,
+    int: same_emittable,
+    long: same_emittable,
+    float: same_emittable,
+    bool: same_emittable,
+    type(None): same_emittable
+}
+
+# converters resolved for each type met
+_emitters = {}
+
+def register_emitter(cls, emitter):
+    """ use ``emitter(value, fields=None, exclude=None)`` to convert
+    the instances of ``cls`` and of its subclasses in
+    ``value_to_emittable`` """
+    EMITTERS[cls] = emitter
+    _emitters.clear()
+
+def find_emitter(cls):
+    """ return the converter of the closest class in the MRO of
+    ``cls`` """
+    try:
+        return _emitters[cls]
+    except KeyError:
+        pass
+    emitter = unicode_to_emittable
+    for base in inspect.getmro(cls):
+        if base in EMITTERS:
+            emitter = EMITTERS[base]
+            break
+    if not issubclass(cls, Manager):
+        # related manager classes are created on each access
+        _emitters[cls] = emitter
+    return emitter
 
 def value_to_emittable(value, fields=None, exclude=None):
     """ convert a value to json using appropriate regexp.
 For Dates we use ISO 8601. Decimal are converted to string.
 """
-    if isinstance(value, QuerySet):
-        value = qs_to_emittable(value, fields=fields, exclude=exclude)
-    elif isinstance(value, datetime.datetime):
-        value = value.replace(microsecond=0).isoformat() + 'Z'
-    elif isinstance(value, datetime.date):
-        value = value.isoformat()
-    elif isinstance(value, datetime.time):
-        value = value.replace(microsecond=0).isoformat()
-    elif isinstance(value, decimal.Decimal):
-        value = str(value)
-    elif isinstance(value, list):
-        value = list_to_emittable(value, fields=fields, exclude=exclude)
-    elif isinstance(value, dict):
-        value = dict_to_emittable(value, fields=fields,
-                exclude=exclude)
-    elif isinstance(value, Model):
-        value = model_to_emittable(value, fields=fields,
-                exclude=exclude)
-
-    elif repr(value).startswith("<django.db.models.fields.related.RelatedManager"):
-        # related managers
-        value = relm_to_emittable(value)
-    else:
-        value = smart_unicode(value, strings_only=True)
-
-    return value
+    try:
+        emitter = _emitters[type(value)]
+    except KeyError:
+        emitter = find_emitter(type(value))
+    return emitter(value, fields, exclude)
 
 def datetime_to_python(value):
     if isinstance(value, basestring):
@@ -176,7 +653,7 @@ def datetime_to_python(value):
             value = datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
         except ValueError, e:
             raise ValueError('Invalid ISO date/time %r' % value)
-        return value
+    return value
 
 def date_to_python(value):
     if isinstance(value, basestring):
@@ -236,4 +713,161 @@ def dict_to_python(value, convert_decimal=True,
         convert_number=True):
     """ convert a json object values to python dict """
     return dict([(k, value_to_python(v,  convert_decimal=convert_decimal, \
-        convert_number=convert_number)) for k, v in value.iteritems()]) 
+        convert_number=convert_number)) for k, v in value.iteritems()])
+
+def decimal_to_python(value):
+    if isinstance(value, decimal.Decimal):
+        return value
+    try:
+        return decimal.Decimal(smart_str(value).strip())
+    except decimal.InvalidOperation:
+        raise ValueError('Invalid decimal %r' % value)
+
+def bool_to_python(value):
+    if isinstance(value, basestring):
+        return value.lower() in ("true", "1", "on", "yes")
+    return bool(value)
+
+def unicode_to_python(value):
+    return value
+
+# converters of the types given in a schema
+TYPE_CONVERTERS = {
+    datetime.datetime: datetime_to_python,
+    datetime.date: date_to_python,
+    datetime.time: time_to_python,
+    decimal.Decimal: decimal_to_python,
+    int: int,
+    long: long,
+    float: float,
+    bool: bool_to_python,
+    str: unicode_to_python,
+    unicode: unicode_to_python
+}
+
+# converters of the Django model fields, by internal type
+MODEL_FIELD_CONVERTERS = {
+    "AutoField": int,
+    "BigIntegerField": long,
+    "BooleanField": bool_to_python,
+    "DateField": date_to_python,
+    "DateTimeField": datetime_to_python,
+    "DecimalField": decimal_to_python,
+    "FloatField": float,
+    "IntegerField": int,
+    "NullBooleanField": bool_to_python,
+    "PositiveIntegerField": int,
+    "PositiveSmallIntegerField": int,
+    "SmallIntegerField": int,
+    "TimeField": time_to_python
+}
+
+# converters of the Django form fields, the first match is used
+FORM_FIELD_CONVERTERS = (
+    (forms.DateTimeField, datetime_to_python),
+    (forms.DateField, date_to_python),
+    (forms.TimeField, time_to_python),
+    (forms.DecimalField, decimal_to_python),
+    (forms.FloatField, float),
+    (forms.IntegerField, int),
+    (forms.BooleanField, bool_to_python)
+)
+
+def model_field_converter(field):
+    if field.rel is not None:
+        # related objects are given by their primary key
+        return model_field_converter(field.rel.get_related_field())
+    return MODEL_FIELD_CONVERTERS.get(field.get_internal_type(),
+            unicode_to_python)
+
+def form_field_converter(field):
+    for cls, converter in FORM_FIELD_CONVERTERS:
+        if isinstance(field, cls):
+            return converter
+    return unicode_to_python
+
+class Schema(object):
+    """ convert the values of unserialized objects by field. Values
+    of fields missing from the schema are guessed with
+    ``value_to_python``. Lists are converted item by item. """
+
+    def __init__(self, converters=None, fallback=value_to_python):
+        """
+        :attr converters: dict {FieldName: Type or Converter}. A
+        converter is a callable taking the unserialized value, or a
+        schema for nested objects.
+        :attr fallback: converter of the other fields
+        """
+        self.converters = {}
+        for name, converter in (converters or {}).items():
+            if isinstance(converter, (dict, Schema)) or \
+                    is_model_or_form(converter):
+                converter = get_schema(converter).to_python
+            elif converter in TYPE_CONVERTERS:
+                converter = TYPE_CONVERTERS[converter]
+            self.converters[name] = converter
+        self.fallback = fallback
+
+    @classmethod
+    def from_model(cls, model):
+        """ build the schema of a Django model. Foreign keys and many
+        to many fields are given by the primary keys of the related
+        objects. """
+        meta = model._meta
+        converters = {}
+        for f in meta.fields:
+            converter = model_field_converter(f)
+            converters[f.name] = converters[f.attname] = converter
+        for f in meta.many_to_many:
+            converters[f.name] = list_converter(model_field_converter(
+                f.rel.get_related_field()))
+        return cls(converters)
+
+    @classmethod
+    def from_form(cls, form):
+        """ build the schema of a Django form class """
+        return cls(dict([(name, form_field_converter(f)) \
+                for name, f in form.base_fields.items()]))
+
+    def to_python(self, value):
+        if isinstance(value, dict):
+            return dict([(k, self.convert(k, v)) \
+                    for k, v in value.iteritems()])
+        elif isinstance(value, list):
+            return [self.to_python(item) for item in value]
+        return self.fallback(value)
+
+    def convert(self, name, value):
+        converter = self.converters.get(name)
+        if converter is None:
+            return self.fallback(value)
+        elif value is None:
+            return None
+        try:
+            return converter(value)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid value %r for %r" % (value, name))
+
+def list_converter(converter):
+    def _convert(value):
+        if isinstance(value, list):
+            return [converter(item) for item in value]
+        return converter(value)
+    return _convert
+
+def is_model_or_form(value):
+    return inspect.isclass(value) and issubclass(value,
+            (Model, forms.BaseForm))
+
+def get_schema(value):
+    """ return the :class:`Schema` of a dict, a model or a form class """
+    if isinstance(value, Schema):
+        return value
+    elif isinstance(value, dict):
+        return Schema(value)
+    elif inspect.isclass(value) and issubclass(value, Model):
+        return Schema.from_model(value)
+    elif inspect.isclass(value) and issubclass(value, forms.BaseForm):
+        return Schema.from_form(value)
+    raise TypeError("a schema should be a Schema, a dict, a model or a "
+            "form class, got %r" % value)
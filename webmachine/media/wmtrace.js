@@ -254,19 +254,35 @@ var ends = {
     '503': {col:'a', row:'13', width:190}
 };
 
+// decisions missing from the diagram, drawn on the node they refine
+var aliases = {
+    'c1':'c3',
+    'c2':'c3',
+    'o18a':'o18',
+    'o18b':'o18'
+};
+
+// the decisions are named b03, their diagram nodes b3
+function node(d) {
+    var name = d[0]+d.slice(1).replace(/^0+/, '');
+    return aliases[name] || name;
+};
+
 var canvas;
 
 function decorateTrace() {
-    trace[0].x = cols[trace[0].d[0]];
-    trace[0].y = rows[trace[0].d.slice(1)];
+    trace[0].node = node(trace[0].d);
+    trace[0].x = cols[trace[0].node[0]];
+    trace[0].y = rows[trace[0].node.slice(1)];
     trace[0].previewCalls = previewCalls(trace[0]);
 
     for (var i = 1; i < trace.length; i++) {
-        trace[i].x = cols[trace[i].d[0]];
-        trace[i].y = rows[trace[i].d.slice(1)];
+        trace[i].node = node(trace[i].d);
+        trace[i].x = cols[trace[i].node[0]];
+        trace[i].y = rows[trace[i].node.slice(1)];
         trace[i].previewCalls = previewCalls(trace[i]);
         
-        var path = edges[trace[i-1].d+trace[i].d];
+        var path = edges[trace[i-1].node+trace[i].node];
         if (path) {
             trace[i].path = [path.length-1];
             for (var p = 1; p < path.length; p++) {
@@ -277,7 +293,7 @@ function decorateTrace() {
         }
     }
     
-    var path = edges[trace[i-1].d+response.code];
+    var path = edges[trace[i-1].node+response.code];
     if (path) {
         var end = ends[path[path.length-1]];
         response.x = cols[end.col];
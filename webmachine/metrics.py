@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -
+#
+# This file is part of dj-webmachine released under the MIT license. 
+# See the NOTICE for more information.
+
+"""
+Decision metrics. Set ``metrics`` on a resource to count the decisions
+visited and time its callbacks:
+
+.. code-block:: python
+
+    from webmachine import Resource
+    from webmachine.metrics import metrics
+
+    class MyResource(Resource):
+        metrics = metrics
+
+Timings are kept in histograms with 4 buckets per power of two, from
+16us (2^4) to about 16s (2^24 us). The content handler is timed as ``body`` and the content
+encoder as ``encoding``. Metrics are available as a dict from
+:meth:`Metrics.snapshot` or in the Prometheus text format from
+:class:`MetricsResource`.
+"""
+
+from __future__ import with_statement
+from bisect import bisect_left
+import threading
+import time
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+from webmachine.resource import Resource
+
+# upper bounds of the histogram buckets, in microseconds: 2^4 to 2^24
+BUCKETS = [int(2 ** (e / 4.0)) for e in range(16, 97)]
+
+class Histogram(object):
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        # the last bucket counts the values above BUCKETS[-1]
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds * 1e6)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """ upper bound in seconds of the bucket holding the
+        percentile ``p`` """
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                if i == len(BUCKETS):
+                    return self.max
+                return BUCKETS[i] / 1e6
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": [(le / 1e6, n) for le, n in zip(BUCKETS,
+                self.counts) if n]
+        }
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.visits = {}
+            self.timings = {}
+
+    def visit(self, res, state):
+        key = (res.__class__.__name__, state.__name__)
+        with self._lock:
+            self.visits[key] = self.visits.get(key, 0) + 1
+
+    def observe(self, res, name, seconds):
+        key = (res.__class__.__name__, name)
+        with self._lock:
+            try:
+                hist = self.timings[key]
+            except KeyError:
+                hist = self.timings[key] = Histogram()
+            hist.record(seconds)
+
+    def timed(self, res, name, func, *args):
+        """ call ``func`` and record its duration under ``name`` """
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.observe(res, name, time.time() - start)
+
+    def snapshot(self):
+        """ return the metrics as a dict::
+
+            {Resource: {"decisions": {Decision: Count},
+                        "callbacks": {Callback: Histogram}}}
+        """
+        resources = {}
+        with self._lock:
+            for (resource, state), n in self.visits.items():
+                res = resources.setdefault(resource,
+                        {"decisions": {}, "callbacks": {}})
+                res["decisions"][state] = n
+            for (resource, name), hist in self.timings.items():
+                res = resources.setdefault(resource,
+                        {"decisions": {}, "callbacks": {}})
+                res["callbacks"][name] = hist.snapshot()
+        return resources
+
+    def prometheus(self):
+        """ return the metrics in the Prometheus text format """
+        lines = ["# TYPE webmachine_decision_visits_total counter"]
+        with self._lock:
+            for (resource, state), n in sorted(self.visits.items()):
+                lines.append('webmachine_decision_visits_total'
+                    '{resource="%s",decision="%s"} %d' % (resource,
+                        state, n))
+
+            lines.append("# TYPE webmachine_callback_seconds histogram")
+            for (resource, name), hist in sorted(self.timings.items()):
+                labels = 'resource="%s",callback="%s"' % (resource, name)
+                seen = 0
+                for le, n in zip(BUCKETS, hist.counts):
+                    seen += n
+                    lines.append('webmachine_callback_seconds_bucket'
+                        '{%s,le="%g"} %d' % (labels, le / 1e6, seen))
+                lines.append('webmachine_callback_seconds_bucket'
+                    '{%s,le="+Inf"} %d' % (labels, hist.count))
+                lines.append('webmachine_callback_seconds_sum{%s} %f' % (
+                    labels, hist.sum))
+                lines.append('webmachine_callback_seconds_count{%s} %d' % (
+                    labels, hist.count))
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+
+class MetricsResource(Resource):
+    """ expose metrics in the Prometheus text format or as JSON """
+
+    def __init__(self, metrics=metrics):
+        self.registry = metrics
+
+    def content_types_provided(self, req, resp):
+        return [
+            ("text/plain", self.to_prometheus),
+            ("application/json", self.to_json)
+        ]
+
+    def to_prometheus(self, req, resp):
+        resp.content_type = "text/plain; version=0.0.4"
+        return self.registry.prometheus()
+
+    def to_json(self, req, resp):
+        return json.dumps(self.registry.snapshot())
+
+    def get_urls(self):
+        from django.conf.urls.defaults import patterns, url
+        return patterns('',
+            url(r'$', self, name="wmmetrics"),
+        )
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -
+#
+# This file is part of dj-webmachine released under the MIT license. 
+# See the NOTICE for more information.
+
+"""
+Sampling profiler. When ``profile_sample_rate`` is set on a resource,
+this part of its requests runs the decisions under cProfile. Profiles
+are aggregated per resource class and can be browsed from the
+``profiles/`` page of :class:`webmachine.wmtrace.WMTraceResource`.
+"""
+
+from __future__ import with_statement
+import pstats
+import threading
+
+try:
+    import cProfile as profile
+except ImportError:
+    import profile
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+SORT_KEYS = ("cumulative", "time", "calls")
+
+class ProfileStore(object):
+    """ aggregate the profiles of each resource class """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+            self.requests = {}
+
+    def run(self, res, func, *args):
+        """ profile the call of ``func`` for the resource ``res`` """
+        prof = profile.Profile()
+        try:
+            return prof.runcall(func, *args)
+        finally:
+            self.add(res.__class__.__name__, prof)
+
+    def add(self, name, prof):
+        with self._lock:
+            if name in self.stats:
+                self.stats[name].add(prof)
+            else:
+                self.stats[name] = pstats.Stats(prof)
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def resources(self):
+        """ return the (Resource, RequestsProfiled) pairs """
+        with self._lock:
+            return sorted(self.requests.items())
+
+    def report(self, name, sort="cumulative", limit=50):
+        """ return the profile of a resource as text or None """
+        if sort not in SORT_KEYS:
+            sort = "cumulative"
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                return None
+            stream = StringIO()
+            stats.stream = stream
+            stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+profiles = ProfileStore()
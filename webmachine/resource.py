@@ -22,8 +22,8 @@ All Resource methods are of the signature:
     def f(self, req, resp):
         return result
 
-``req`` is a :class:`django.http.HttpRequest` instance, and ``resp`` a
-:class:`django.http.HttpResource` instance. This instances have been
+``req`` wraps the :class:`django.http.HttpRequest` instance, and ``resp``
+is a :class:`django.http.HttpResource` instance. This instances have been
 :ref:`improved to support more HTTP semantics <http>`. At any time you
 can manipulate this object to return the response you want or pass
 values to other methods.
@@ -32,26 +32,20 @@ There are over 30 Resource methods you can define, but any of them can
 be omitted as they have reasonable defaults.
 """
 
-from __future__ import with_statement
-from datetime import datetime
-import os
 import re
 import sys
-import traceback
-import types
-
-try:
-    import json
-except ImportError:
-    import django.utils.simplejson as json
 
 from django.utils.translation import activate, deactivate_all, get_language, \
 string_concat
 from django.utils.encoding import smart_str, force_unicode
 
-from webmachine.exc import HTTPException, HTTPInternalServerError
+from webmachine.conneg import negotiator
+from webmachine.exc import HTTPException
+from webmachine.profiling import profiles
+from webmachine.tracing import Tracer, get_writer, sampled
 from webmachine.wrappers import WMRequest, WMResponse
-from webmachine.decisions import b13, TRANSITIONS, first_match
+from webmachine.decisions import b13, TRANSITIONS, CACHEABLE_CALLBACKS, \
+callback, compile_flow, first_match, media_types
 
 
 CHARSET_RE = re.compile(r';\s*charset=([^;]*)', re.I)
@@ -59,58 +53,6 @@ get_verbose_name = lambda class_name: re.sub('(((?<=[a-z])[A-Z])|([A-Z](?![A-Z]|
 
 DEFAULT_NAMES = ('verbose_name', 'app_label', 'resource_path')
 
-def update_trace(resource, state, req, resp, trace):
-    if not resource.trace:
-        # do nothing
-        return
-
-    infos = {
-            "request": {
-                "headers": req.headers.items(),
-                "get": [(k, req.GET.getlist(k)) for k in req.GET],
-                "post": [(k, req.POST.getlist(k)) for k in req.POST],
-                "cookies": [(k, req.COOKIES.get(k)) for k in req.COOKIES],
-                "url_args": req.url_args,
-                "url_kwarg": req.url_kwargs
-            },
-            "response": {
-                "code": resp.status_code,
-                "headers": resp.headerlist
-            }
-
-    }
-
-    if hasattr(req, 'session'):
-        infos['request'].update({
-            'session': [(k, req.session.get(k)) for k in \
-                    req.session.keys()]
-        })
-
-    if isinstance(state, int):
-        name = str(state)
-    else:
-        name = state.__name__
-
-    trace.append((name, infos))
-
-def update_ex_trace(trace, e):
-    trace.append(("error", traceback.format_exc()))
-
-def write_trace(res, trace):
-    if not res.trace:
-        return
-
-    if not res.trace_path:
-        trace_path = "/tmp"
-
-    now = datetime.now().replace(microsecond=0).isoformat() + 'Z'
-    fname = os.path.join(os.path.abspath(trace_path),
-            "wmtrace-%s-%s.json" % (res.__class__.__name__, now))
-
-    with open(fname, "w+b") as f:
-        f.write(json.dumps(trace))
-
-
 class Options(object):
     """ class based on django.db.models.options. We only keep
     useful bits."""
@@ -197,6 +139,11 @@ class ResourceMeta(type):
 
         
         new_class.add_to_class('_meta',  Options(meta, app_label=app_label))
+
+        # prune the decision graph from the callbacks left to default
+        new_class._flow = compile_flow(overridden_callbacks(new_class))
+        new_class._cacheable = frozenset(CACHEABLE_CALLBACKS).difference(
+                new_class.uncached_callbacks)
         return new_class
     
     def add_to_class(cls, name, value):
@@ -207,21 +154,31 @@ class ResourceMeta(type):
 
 
 RESOURCE_METHODS = ["allowed_methods", "allow_missing_post",
-"auth_required", "charsets_provided", "content_types_accepted",
-"content_types_provided", "created_location", "delete_completed",
-"delete_resource", "encodings_provided", "expires", "finish_request",
-"forbidden", "format_suffix_accepted", "generate_etag", "is_authorized",
-"is_conflict", "known_content_type", "known_methods",
+"auth_required", "charsets_provided", "content_length",
+"content_types_accepted", "content_types_provided", "created_location",
+"delete_completed", "delete_resource", "encodings_provided", "expires",
+"finish_request", "forbidden", "format_suffix_accepted", "generate_etag",
+"is_authorized", "is_conflict", "known_content_type", "known_methods",
 "languages_provided", "last_modified", "malformed_request",
 "moved_permanently", "moved_temporarily", "multiple_choices", "options",
 "ping", "post_is_create", "previously_existed", "process_post",
-"resource_exists", "service_available", "uri_too_long",
-"valid_content_headers", "valid_entity_length", "variances"]
-
-
-# FIXME: we should propbably wrap full HttpRequest object instead of
-# adding properties to it in __call__ . Also datetime_utils has surely
-# equivalent in Django. 
+"ranges_provided", "resource_exists", "service_available",
+"uri_too_long", "valid_content_headers", "valid_entity_length",
+"validators", "variances"]
+
+def overridden_callbacks(res):
+    """ return the set of resource methods which aren't the
+    :class:`Resource` defaults. ``res`` can be a resource class or
+    instance. """
+    overridden = set()
+    for name in RESOURCE_METHODS:
+        func = getattr(res, name)
+        if getattr(func, 'im_func', func) is not Resource.__dict__[name]:
+            overridden.add(name)
+    return overridden
+
+
+# FIXME: datetime_utils has surely equivalent in Django. 
 class Resource(object):
     __metaclass__ = ResourceMeta
 
@@ -231,6 +188,35 @@ class Resource(object):
 
     trace = False
     trace_path = None
+    # part of the requests traced
+    trace_sample_rate = 1.0
+    # size in bytes of the trace segments, and number of segments kept
+    # in trace_path by each process. None keeps them all.
+    trace_segment_size = 16 << 20
+    trace_max_segments = 64
+
+    # reuse the result of the callbacks in CACHEABLE_CALLBACKS during
+    # a request. Callbacks returning different values on each call
+    # can be listed in uncached_callbacks.
+    cache_callbacks = False
+    uncached_callbacks = ()
+
+    # cache of the content negotiation results
+    negotiator = negotiator
+
+    # cache of the generated bodies, see webmachine.cache
+    representation_cache = None
+
+    # run the content handler for HEAD requests, when it checks the
+    # existence or sets headers
+    head_runs_handler = False
+
+    # decisions and callbacks metrics, see webmachine.metrics
+    metrics = None
+
+    # part of the requests profiled, see webmachine.profiling
+    profile_sample_rate = 0
+    profiles = profiles
 
     def allowed_methods(self, req, resp):
         """
@@ -285,6 +271,16 @@ class Resource(object):
         """
         return []
 
+    def content_length(self, req, resp):
+        """
+        HEAD requests don't run the content handler nor the encoders,
+        unless ``head_runs_handler`` is set. If the size of the representation is cheap to know, return it
+        to send it as the Content-Length of HEAD responses.
+
+        :return: int or None
+        """
+        return None
+
     def content_types_provided(self, req, resp):
         """
         This should return a list of pairs where each pair is of the form 
@@ -340,6 +336,8 @@ class Resource(object):
             return [("identity", lambda x: x)]
 
         Returning None prevents the encoding negotiation logic.
+        Stock gzip and deflate encoders are available in
+        :mod:`webmachine.helpers.encoders`.
 
         :return: [(Encoding, Encoder)]
         """
@@ -513,6 +511,18 @@ class Resource(object):
         """
         return False
 
+    def ranges_provided(self, req, resp):
+        """
+        Range units accepted, sent in the Accept-Ranges header. Only
+        "bytes" ranges are handled: a GET with a single byte range gets
+        a 206 Partial Content with this part of the body. Only ``str``
+        bodies and :class:`webmachine.helpers.files.FileBody` can be
+        sent by parts, requests for several ranges get the whole body.
+
+        :return: [Unit] or None
+        """
+        return None
+
     def resource_exists(self, req, resp):
         """
         Returning non-true values will result in 404 Not Found.
@@ -545,6 +555,21 @@ class Resource(object):
         """
         return True
 
+    def validators(self, req, resp):
+        """
+        If this returns a pair, the conditional headers of the request
+        are checked against it before the content negotiation and
+        resource_exists, so a 304 Not Modified or a 412 Precondition
+        Failed can be returned without looking up the resource. Use it
+        when the validators come from a cheap source, like a version
+        number kept in a cache. The values returned are then used in
+        place of generate_etag and last_modified, and removed from the
+        response when resource_exists returns False.
+
+        :return: (Etag, LastModified) or None
+        """
+        return None
+
     def variances(self, req, resp):
         """
         If this function is implemented, it should return a list 
@@ -584,11 +609,14 @@ class Resource(object):
     def _process(self, req, *args, **kwargs):
         """ Process request and return the response """
 
-        req = WMRequest(req.environ, *args, **kwargs)
+        req = WMRequest(req, *args, **kwargs)
 
         # initialize response object
         resp = WMResponse(request=req)
 
+        if self.cache_callbacks:
+            req.wm_callbacks = {}
+
         # force format ?
         url_parts = req.path.rsplit(".", 1)
         try:
@@ -602,36 +630,42 @@ class Resource(object):
 
 
   
-        ctypes = [ct for (ct, func) in (self.content_types_provided(req, resp) or [])]
+        ctypes = media_types(callback(self, "content_types_provided",
+            req, resp))
         if len(ctypes):
             ctype = ctypes[0]
             if not ctype:
                 ctype = resp.default_content_type 
             resp.content_type = ctype
 
-        trace = []
+        tracer = None
+        if self.trace and sampled(self.trace_sample_rate):
+            tracer = Tracer(self, req, resp)
+            # keep all the decisions in the trace
+            state, flow = b13, TRANSITIONS
+        else:
+            state, flow = self._flow
         try:
-            state = b13
-            while not isinstance(state, int):
-                if state(self, req, resp):
-                    state = TRANSITIONS[state][0]
-                else:
-                    state = TRANSITIONS[state][1]
-
-                if not isinstance(state, (int, types.FunctionType)):
-                    raise HTTPInternalServerError("Invalid state: %r" % state)
-                update_trace(self, state, req, resp, trace)                
+            if self.profile_sample_rate and \
+                    sampled(self.profile_sample_rate):
+                state = self.profiles.run(self, self._walk, req, resp,
+                        state, flow, tracer)
+            else:
+                state = self._walk(req, resp, state, flow, tracer)
             resp.status_code = state
         except HTTPException, e:
             # Error while processing request
             # Return HTTP response
-            update_ex_trace(trace, e)
+            if tracer is not None:
+                tracer.update_error()
+                self.trace_writer().write(tracer.record(e.status_code))
             return e
          
         self.finish_request(req, resp)
        
         # write the trace if needed
-        write_trace(self, trace)
+        if tracer is not None:
+            self.trace_writer().write(tracer.record(state))
 
         # hack, django try to cache all the response and put it in
         # pickle rather than just caching needed infos.
@@ -642,5 +676,28 @@ class Resource(object):
         # return final response.
         return resp
 
+    def trace_writer(self):
+        return get_writer(self.trace_path,
+                segment_size=self.trace_segment_size,
+                max_segments=self.trace_max_segments)
+
+    def _walk(self, req, resp, state, flow, tracer):
+        """ run the decisions from ``state`` and return the status
+        code """
+        while not isinstance(state, int):
+            decision = state
+            if self.metrics is not None:
+                self.metrics.visit(self, state)
+            if state(self, req, resp):
+                state = flow[state][0]
+            else:
+                state = flow[state][1]
+            if tracer is not None:
+                tracer.update(decision, resp)
+        return state
+
     def __call__(self, request, *args, **kwargs):
         return self._process(request, *args, **kwargs)
+
+Resource._flow = compile_flow(set())
+Resource._cacheable = frozenset(CACHEABLE_CALLBACKS)
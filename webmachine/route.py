@@ -55,8 +55,15 @@ resource:
     * authorization
 
 """
+from django.utils.datastructures import SortedDict
+from django.utils.html import escape
+
 import webmachine.exc
-from webmachine.resource import Resource, RESOURCE_METHODS
+from webmachine.decisions import compile_flow, find_match
+from webmachine.dispatch import Dispatcher
+from webmachine.resource import Resource, RESOURCE_METHODS, \
+overridden_callbacks
+from webmachine.util import MediaTable
 
 try:
     from cStringIO import StringIO
@@ -85,8 +92,74 @@ def build_ctypes(ctypes,method):
         else:
             yield ctype, lambda v: v
 
+def stream_dumper(cb, stream_cb):
+    def _dump(value):
+        if hasattr(value, "next"):
+            # iterators and generators are serialized lazily
+            return stream_cb(value)
+        return cb(value)
+    return _dump
+
+def build_dumpers(ctypes):
+    """ return (MediaType, Dumper) pairs. Serializers with a
+    ``serialize_stream`` method are used to serialize the iterators
+    returned by the route function chunk by chunk. """
+    for ctype in ctypes:
+        if isinstance(ctype, tuple):
+            serializer = ctype[1]
+            cb = serializer_cb(serializer, "serialize")
+            if hasattr(serializer, "serialize_stream"):
+                cb = stream_dumper(cb, serializer.serialize_stream)
+            yield ctype[0], cb
+        else:
+            yield ctype, lambda v: v
+
+def bad_request(e):
+    return webmachine.exc.HTTPBadRequest(detail=escape(str(e)))
+
+def body_loader(cb):
+    def _load(req):
+        try:
+            return cb(req.body)
+        except ValueError, e:
+            # malformed body or values
+            raise bad_request(e)
+    return _load
+
+def checked_rows(rows):
+    """ iterate over the rows unserialized lazily, a malformed one is
+    a bad request """
+    try:
+        for row in rows:
+            yield row
+    except ValueError, e:
+        raise bad_request(e)
+
+def stream_loader(cb):
+    def _load(req):
+        return checked_rows(cb(req.body_file))
+    return _load
+
+def build_loaders(ctypes):
+    """ return (MediaType, Loader) pairs. A loader takes the request
+    and returns its unserialized body. Serializers with an
+    ``unserialize_stream`` method read the body from a file-like object
+    instead of loading it in memory. """
+    for ctype in ctypes:
+        if isinstance(ctype, tuple):
+            serializer = ctype[1]
+            if hasattr(serializer, "unserialize_stream"):
+                yield ctype[0], stream_loader(serializer.unserialize_stream)
+            else:
+                cb = serializer_cb(serializer, "unserialize")
+                yield ctype[0], body_loader(cb)
+        else:
+            yield ctype, body_loader(lambda v: v)
+
 
 class RouteResource(Resource):
+    # the route function is the only existence check of a route
+    head_runs_handler = True
 
     def __init__(self, pattern, fun, **kwargs):
         self.set_pattern(pattern, **kwargs)
@@ -106,11 +179,11 @@ class RouteResource(Resource):
         # build content provided list
         provided = validate_ctype(kwargs.get('provided') or \
                 ['text/html'])
-        self.provided = list(build_ctypes(provided, "serialize"))
+        self.provided = list(build_dumpers(provided))
 
         # build content accepted list
         accepted = validate_ctype(kwargs.get('accepted')) or []
-        self.accepted = list(build_ctypes(accepted, "unserialize"))
+        self.accepted = list(build_loaders(accepted))
         self.kwargs = kwargs
 
         # override method if needed
@@ -118,6 +191,10 @@ class RouteResource(Resource):
             if k in RESOURCE_METHODS:
                 setattr(self, k, self.wrap(v))           
 
+        # callbacks may have been overridden on the instance
+        self._flow = compile_flow(overridden_callbacks(self))
+        self.build_tables()
+
     def set_pattern(self, pattern, **kwargs):
         self.url = (pattern, kwargs.get('name'))
 
@@ -135,14 +212,34 @@ class RouteResource(Resource):
         # we probably should merge here
         provided = validate_ctype(kwargs.get('provided'))
         if provided is not None:
-            provided = list(build_ctypes(provided, "serialize"))
+            provided = list(build_dumpers(provided))
             self.provided.extend(provided)
         
         accepted = validate_ctype(kwargs.get('accepted'))
         if accepted is not None:
-            accepted = list(build_ctypes(accepted, "unserialize"))
+            accepted = list(build_loaders(accepted))
             self.accepted.extend(accepted)
+        self.build_tables()
+
+    def build_tables(self):
+        """ precompute the tables returned by the callbacks, so
+        requests neither build closures nor scan lists """
+        self.dumpers = MediaTable(self.provided)
+        self.loaders = MediaTable(self.accepted)
+
+        self.handlers = {}
+        for method, fun in self.methods.items():
+            if self.provided:
+                handlers = [(c, self.wrap(fun, f)) for c, f in self.provided]
+            else:
+                handlers = [("text/html", self.wrap(fun))]
+            self.handlers[method] = MediaTable(handlers)
 
+        if self.accepted:
+            self.accepted_handlers = MediaTable([(c, self.accept_body) \
+                    for c, f in self.accepted])
+        else:
+            self.accepted_handlers = None
 
     def wrap(self, f, cb=None):
         def _wrapped(req, resp):
@@ -152,18 +249,15 @@ class RouteResource(Resource):
         return _wrapped
 
     def first_match(self, media, expect):
-        for key, value in media:
-            if key == expect:
-                return value
-        return None
+        return find_match(media, expect)
 
     def accept_body(self, req, resp):
         ctype = req.content_type or "application/octet-stream"
         mtype = ctype.split(";", 1)[0]
-        funload = self.first_match(self.accepted, mtype)
+        funload = self.loaders.get(mtype)
         if funload is None:
             raise webmachine.exc.HTTPUnsupportedMediaType()
-        req._raw_post_data = funload(req.raw_post_data)
+        req._raw_post_data = funload(req)
         if isinstance(req._raw_post_data, basestring):
             req._stream = StringIO(req._raw_post_data)
 
@@ -177,12 +271,12 @@ class RouteResource(Resource):
         return self.return_body(req, resp)
 
     def return_body(self, req, resp):
-        fundump = self.first_match(self.provided, resp.content_type)
+        fundump = self.dumpers.get(resp.content_type)
         if fundump is None:
             raise webmachine.exc.HTTPInternalServerError()
         resp._container = fundump(resp._container)
         if not isinstance(resp._container, basestring):
-            resp._is_tring = False
+            resp._is_string = False
         else:
             resp._container = [resp._container]
             resp._is_string = True
@@ -200,16 +294,11 @@ class RouteResource(Resource):
         return []
 
     def content_types_accepted(self, req, resp):
-        if not self.accepted:
-            return None
-        return [(c, self.accept_body) for c, f in self.accepted]
+        return self.accepted_handlers
         
     def content_types_provided(self, req, resp):
-        fun = self.methods[req.method]
-        if not self.provided:
-            return [("text/html", self.wrap(fun))]
-
-        return [(c, self.wrap(fun, f)) for c, f in self.provided]
+        # unknown methods are refused by allowed_methods
+        return self.handlers.get(req.method, ())
 
     def delete_resource(self, req, resp):
         fun = self.methods['DELETE']
@@ -251,8 +340,11 @@ class WM(object):
     def __init__(self, name="webmachine", version=None):
         self.name = name
         self.version = version
-        self.resources = {}
+        # keep the urls in registration order
+        self.resources = SortedDict()
         self.routes = []
+        self.revision = 0
+        self.dispatcher = Dispatcher(self)
 
     def route(self, pattern, **kwargs):
         """
@@ -292,6 +384,15 @@ class WM(object):
                     # ... do something to value
                     return value
 
+        When the function returns an iterator, a serializer providing a
+        ``serialize_stream(iterator)`` method is used to generate the
+        response body chunk by chunk.
+
+        A serializer providing an ``unserialize_stream(stream)`` method
+        reads the request body from a file-like object instead of a
+        string, so large bodies can be consumed incrementally. See
+        :class:`webmachine.helpers.serialize.NDJSONSerializer`.
+
 
         :attr formats: return a list of format with their associated 
         contenttype::
@@ -341,6 +442,7 @@ class WM(object):
                 pattern = r'%s/' % kname
         res.get_urls = self._wrap_urls(res.get_urls, pattern)
         self.resources[pattern] = res
+        self.revision += 1
 
     def add_resources(self, *klasses):
         """
@@ -365,6 +467,7 @@ class WM(object):
         else:
             res = RouteResource(pattern, func, **kwargs)
         self.resources[pattern] = res
+        self.revision += 1
 
         self.routes.append((pattern, func, kwargs))
         # associate the resource to the function
@@ -380,4 +483,14 @@ class WM(object):
 
     urls = property(get_urls)
 
+    def get_dispatch_urls(self):
+        """ return an urlpattern sending all the paths to the radix tree
+        dispatcher, see :mod:`webmachine.dispatch` """
+        from django.conf.urls.defaults import patterns, url
+        return patterns('',
+            url(r'^(?P<wm_path>.*)$', self.dispatcher)
+        )
+
+    dispatch_urls = property(get_dispatch_urls)
+
 wm = WM()
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -
+#
+# This file is part of dj-webmachine released under the MIT license. 
+# See the NOTICE for more information.
+
+"""
+Decision traces. When ``trace`` is set on a resource, a sample of its
+requests is traced. A trace keeps a snapshot of the request, then for
+each decision its name and the response headers it changed. Traces are
+queued and written to ``trace_path`` by a background thread, so the
+request thread never waits on the disk.
+
+Traces are appended, one JSON document per line, to segment files
+``wmtrace-<pid>-<seq>.log``. A new segment is started when the current
+one reaches ``segment_size``. Each segment has a sidecar index
+``wmtrace-<pid>-<seq>.idx`` made of fixed size records (resource, time,
+status, offset, length), so traces can be counted, paged and read
+without scanning the segments.
+"""
+
+from __future__ import with_statement
+from datetime import datetime
+from glob import glob
+import os
+import Queue
+import random
+import threading
+import time
+import traceback
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+
+def sampled(rate):
+    """ return True for ``rate`` of the calls """
+    return rate >= 1 or random.random() < rate
+
+
+class Tracer(object):
+    """ collect the decisions taken for a request """
+
+    def __init__(self, res, req, resp):
+        self.resource = res.__class__.__name__
+        self.time = time.time()
+        self.request = {
+            "method": req.method,
+            "path": req.path,
+            "headers": req.headers.items(),
+            "get": [(k, req.GET.getlist(k)) for k in req.GET],
+            "url_args": req.url_args,
+            "url_kwargs": req.url_kwargs
+        }
+        self.decisions = []
+        self.error = None
+        self._headers = dict(resp.items())
+
+    def update(self, state, resp):
+        """ add a decision with the response headers it changed """
+        headers = dict(resp.items())
+        delta = {}
+        for name, value in headers.items():
+            if self._headers.get(name) != value:
+                delta[name] = value
+        for name in self._headers:
+            if name not in headers:
+                delta[name] = None
+        self._headers = headers
+        self.decisions.append({"d": state.__name__, "headers": delta})
+
+    def update_error(self):
+        self.error = traceback.format_exc()
+
+    def record(self, status):
+        # webmachine.exc exceptions have a "CODE Title" status
+        status = int(str(status).split()[0])
+        return {
+            "resource": self.resource,
+            "time": self.time,
+            "request": self.request,
+            "response": {
+                "code": status,
+                "headers": self._headers.items()
+            },
+            "trace": self.decisions,
+            "error": self.error
+        }
+
+
+INDEX_FORMAT = "%-48s %17.6f %3d %10d %10d\n"
+INDEX_RECORD_SIZE = len(INDEX_FORMAT % ("", 0, 0, 0, 0))
+
+def parse_index_record(segment, line):
+    (resource, t, status, offset, length) = line.split()
+    return {
+        "resource": resource,
+        "time": datetime.fromtimestamp(float(t)),
+        "status": int(status),
+        "segment": segment,
+        "offset": int(offset),
+        "length": int(length)
+    }
+
+
+class TraceWriter(object):
+    """ write the traces from a bounded queue in a background thread.
+    Traces are dropped when the queue is full. """
+
+    def __init__(self, path, maxsize=1000, segment_size=16 << 20,
+            max_segments=None):
+        """
+        :attr path: directory where the traces are written
+        :attr maxsize: maximum number of traces waiting to be written
+        :attr segment_size: size in bytes from which a new segment
+        is started
+        :attr max_segments: number of segments of this process kept in
+        ``path``, the oldest are removed. None keeps them all.
+        """
+        self.path = os.path.abspath(path)
+        self.queue = Queue.Queue(maxsize)
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.dropped = 0
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._log = self._index = None
+
+    def write(self, record):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """ wait until all the queued traces are written """
+        self.queue.join()
+
+    def dump(self, record):
+        if self._log is None or self._log.tell() >= self.segment_size:
+            self._rotate()
+
+        # build both lines first so no trace is left without index
+        data = json.dumps(record) + "\n"
+        offset = self._log.tell()
+        entry = INDEX_FORMAT % (record["resource"][:48], record["time"],
+                record["response"]["code"], offset, len(data))
+        self._log.write(data)
+        self._log.flush()
+        self._index.write(entry)
+        self._index.flush()
+
+    def _rotate(self):
+        if self._log is not None:
+            self._log.close()
+            self._index.close()
+
+        self._seq += 1
+        prefix = "wmtrace-%s-" % os.getpid()
+        name = os.path.join(self.path, "%s%06d" % (prefix, self._seq))
+        self._log = open(name + ".log", "ab")
+        self._index = open(name + ".idx", "ab")
+
+        if self.max_segments is not None:
+            # only remove the segments written by this process, other
+            # workers may be writing theirs
+            own = [segment for segment in TraceLog(self.path).segments() \
+                    if segment.startswith(prefix)]
+            for segment in own[self.max_segments:]:
+                for ext in (".log", ".idx"):
+                    try:
+                        os.unlink(os.path.join(self.path, segment + ext))
+                    except OSError:
+                        pass
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # first trace, or first one since the process forked
+                self._log = self._index = None
+                t = threading.Thread(target=self._run,
+                        name="wmtrace-writer")
+                t.setDaemon(True)
+                t.start()
+                self._thread = t
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            try:
+                try:
+                    self.dump(record)
+                except Exception:
+                    traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+
+class TraceLog(object):
+    """ read the traces written in a directory """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def segments(self):
+        """ return the segments names, newest first """
+        indexes = glob(os.path.join(self.path, "wmtrace-*.idx"))
+        indexes.sort(key=lambda f: (os.path.getmtime(f), f), reverse=True)
+        return [os.path.basename(idx)[:-4] for idx in indexes]
+
+    def count(self):
+        return sum([self._size(segment) for segment in self.segments()])
+
+    def _size(self, segment):
+        fname = os.path.join(self.path, segment + ".idx")
+        return os.path.getsize(fname) // INDEX_RECORD_SIZE
+
+    def entries(self, start=0, resource=None, block=1000):
+        """ iterate over the index records, newest first, skipping the
+        ``start`` first ones. Only the traces of ``resource`` are
+        returned when it's given. """
+        for segment in self.segments():
+            n = self._size(segment)
+            if resource is None and start >= n:
+                # skip the segment without reading it
+                start -= n
+                continue
+
+            with open(os.path.join(self.path, segment + ".idx"), "rb") as f:
+                end = n
+                if resource is None:
+                    end -= start
+                    start = 0
+                while end > 0:
+                    begin = max(end - block, 0)
+                    f.seek(begin * INDEX_RECORD_SIZE)
+                    data = f.read((end - begin) * INDEX_RECORD_SIZE)
+                    lines = data.splitlines()
+                    lines.reverse()
+                    for line in lines:
+                        entry = parse_index_record(segment, line)
+                        if resource is not None:
+                            if entry["resource"] != resource:
+                                continue
+                            if start:
+                                start -= 1
+                                continue
+                        yield entry
+                    end = begin
+
+    def read(self, segment, offset):
+        """ return the JSON trace written at ``offset`` in ``segment``
+        or None """
+        fname = os.path.join(self.path, segment + ".log")
+        try:
+            with open(fname, "rb") as f:
+                f.seek(offset)
+                return f.readline() or None
+        except IOError:
+            return None
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_writer(path=None, **options):
+    """ return the trace writer shared by the resources tracing to
+    ``path``. ``options`` (``segment_size``, ``max_segments``) are
+    given to the :class:`TraceWriter` and update the settings of an
+    existing one. """
+    path = os.path.abspath(path or "/tmp")
+    with _writers_lock:
+        if path not in _writers:
+            _writers[path] = TraceWriter(path, **options)
+        writer = _writers[path]
+        for name, value in options.items():
+            setattr(writer, name, value)
+        return writer
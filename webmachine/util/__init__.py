@@ -4,6 +4,7 @@
 # See the NOTICE for more information.
 
 import random
+import threading
 import time
 
 CHARS = 'abcdefghijklmnopqrstuvwxyz0123456789!@#$%^&*(-_=+)'
@@ -66,3 +67,82 @@ def serialize_list(value):
     else:
         return ', '.join([str(v) for v in value])
 
+
+
+class LRUCache(object):
+    """ a bounded mapping discarding the least recently used keys
+    first. Access is serialized with a lock so the cache can be shared
+    between threads. """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._data = {}
+        # circular doubly linked list of [prev, next, key, value]
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        self._lock.acquire()
+        try:
+            link = self._data[key]
+            # move the link in front of the root
+            prev, next = link[0], link[1]
+            prev[1], next[0] = next, prev
+            root = self._root
+            last = root[0]
+            last[1] = root[0] = link
+            link[0], link[1] = last, root
+            return link[3]
+        finally:
+            self._lock.release()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        self._lock.acquire()
+        try:
+            root = self._root
+            if key in self._data:
+                self._data[key][3] = value
+                return
+            if len(self._data) >= self.size:
+                # reuse the oldest link
+                oldest = root[1]
+                del self._data[oldest[2]]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+            last = root[0]
+            link = [last, root, key, value]
+            last[1] = root[0] = self._data[key] = link
+        finally:
+            self._lock.release()
+
+class MediaTable(tuple):
+    """ an immutable list of (Key, Value) pairs, like the ones returned
+    by content_types_provided. ``types`` holds the keys and ``lookup``
+    maps a key to the value of its first pair. """
+
+    def __new__(cls, pairs=()):
+        self = tuple.__new__(cls, pairs)
+        self.types = tuple([key for key, value in self])
+        self.lookup = {}
+        for key, value in self:
+            self.lookup.setdefault(key, value)
+        return self
+
+    def get(self, key, default=None):
+        return self.lookup.get(key, default)
@@ -5,44 +5,78 @@
 
 import os
 import os.path
-from glob import iglob
-
-try:
-    import json
-except ImportError:
-    import django.utils.simplejson as json
+from itertools import islice
 
 from django.template.loader import render_to_string
-from django.utils.encoding import smart_str
 from django.views import static
 from webmachine import Resource
+from webmachine.profiling import profiles
+from webmachine.tracing import TraceLog
 
 class WMTraceResource(Resource):
 
-    def __init__(self, path="/tmp"):
+    per_page = 50
+
+    def __init__(self, path="/tmp", profiles=profiles):
         if path.endswith("/"):
             path = path[:-1]
         self.path = os.path.abspath(path)
+        self.log = TraceLog(self.path)
+        self.profiles = profiles
+
+    def resource_exists(self, req, resp):
+        if "profile" in req.url_kwargs:
+            req.profile = self.profiles.report(req.url_kwargs["profile"],
+                    sort=req.GET.get("sort", "cumulative"))
+            return req.profile is not None
+        elif "segment" in req.url_kwargs:
+            req.trace = self.log.read(req.url_kwargs["segment"],
+                    int(req.url_kwargs["offset"]))
+            return req.trace is not None
+        return True
     
     def trace_list_html(self, req, resp):
-        files = [os.path.basename(f).split("wmtrace-")[1] for f in \
-                iglob("%s/wmtrace-*.*" % self.path)]
+        resource = req.GET.get("resource") or None
+        try:
+            page = max(int(req.GET.get("page", 1)), 1)
+        except ValueError:
+            page = 1
+
+        entries = list(islice(self.log.entries(
+            start=(page - 1) * self.per_page, resource=resource),
+            self.per_page + 1))
         return render_to_string("wm/wmtrace_list.html", {
             "path": self.path, 
-            "files": files
+            "traces": entries[:self.per_page],
+            "resource": resource,
+            "page": page,
+            "has_next": len(entries) > self.per_page
         })
 
     def trace_html(self, req, resp):
-        fname = req.url_kwargs["file"]
-        fname = os.path.join(self.path, "wmtrace-%s" % fname)
-        with open(fname, "r+b") as f:
-            return render_to_string("wm/wmtrace.html", {
-                "fname": fname,
-                "trace": f.read()
-            })
+        return render_to_string("wm/wmtrace.html", {
+            "fname": "%s:%s" % (req.url_kwargs["segment"],
+                req.url_kwargs["offset"]),
+            "trace": req.trace
+        })
+
+    def profile_list_html(self, req, resp):
+        return render_to_string("wm/wmprofile_list.html", {
+            "resources": self.profiles.resources()
+        })
+
+    def profile_html(self, req, resp):
+        return render_to_string("wm/wmprofile.html", {
+            "resource": req.url_kwargs["profile"],
+            "profile": req.profile
+        })
 
     def to_html(self, req, resp):
-        if "file" in req.url_kwargs:
+        if "profile" in req.url_kwargs:
+            return self.profile_html(req, resp)
+        elif req.url_kwargs.get("view") == "profiles":
+            return self.profile_list_html(req, resp)
+        elif "segment" in req.url_kwargs:
             return self.trace_html(req, resp)
         return self.trace_list_html(req, resp)
 
@@ -51,14 +85,17 @@ class WMTraceResource(Resource):
         from django.conf.urls.defaults import patterns, url
         media_path = os.path.abspath(os.path.join(__file__, "..",
             "media"))
-        print media_path
         urlpatterns = patterns('',
-            url(r'wmtrace-(?P<file>.+)$', self, name="wmtrace"),
+            url(r'^(?P<segment>wmtrace-\d+-\d+)/(?P<offset>\d+)$', self,
+                name="wmtrace"),
+            url(r'^profiles/$', self, {"view": "profiles"},
+                name="wmprofile_list"),
+            url(r'^profiles/(?P<profile>\w+)$', self, name="wmprofile"),
             url(r'^static/(?P<path>.*)', static.serve, {
                 'document_root': media_path,
                 'show_indexes': False
             }),
-            url(r'$', self, name="wmtrace_list"),
+            url(r'^$', self, name="wmtrace_list"),
             
         )
 
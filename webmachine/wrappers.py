@@ -4,61 +4,272 @@
 # See the NOTICE for more information.
 import re
 
-from django.core.handlers.wsgi import WSGIRequest
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
 from django.http import HttpResponse
 from webob import Request
 from webob.descriptors import *
 from webob.datetime_utils import *
-from webob.headers import ResponseHeaders
+from webob.headers import EnvironHeaders
 
 
 _PARAM_RE = re.compile(r'([a-z0-9]+)=(?:"([^"]*)"|([a-z0-9_.-]*))', re.I)
 _OK_PARAM_RE = re.compile(r'^[a-z0-9_.-]+$', re.I)
 
-class WMRequest(WSGIRequest, Request):
-
-    environ = None
-    path = None
-    method = None
-    META = None
+def parsed_header(name, key):
+    """ reuse the WebOb request property ``name`` parsing the environ
+    ``key``. The parsed value is kept until the header changes. """
+    fget = getattr(Request, name).fget
 
-    def __init__(self, environ, *args, **kwargs):
-        Request.__init__(self, environ)
-        WSGIRequest.__init__(self, environ)
+    def _get(self):
+        raw = self.META.get(key)
+        parsed = self.__dict__.setdefault('_parsed', {})
+        try:
+            cached_raw, value = parsed[name]
+            if cached_raw == raw:
+                return value
+        except KeyError:
+            pass
+        value = fget(self)
+        parsed[name] = (raw, value)
+        return value
+    return property(_get, doc=getattr(Request, name).__doc__)
+
+class BodyInput(object):
+    """ a file-like object reading the body of a Django request. The
+    body is only read when this object is first used. """
+
+    def __init__(self, request):
+        self._request = request
+
+    def __getattr__(self, name):
+        if '_file' not in self.__dict__:
+            request = self._request
+            started = request._read_started
+            self._file = StringIO(request.raw_post_data)
+            # Django keeps a copy of the body it can still parse
+            request._read_started = started
+        return getattr(self._file, name)
+
+class WMRequest(object):
+    """ Wrap the Django request passed to the resource and add the
+    WebOb properties used by the decisions. Headers are only parsed
+    when they are accessed. Any other attribute is read from and set on
+    the Django request, or from ``webob`` when only WebOb provides it
+    (``url``, ``params``, ``host_url``, ``authorization``, ...). """
+
+    # attributes kept on the wrapper
+    _local = ('url_args', 'url_kwargs', 'wm_callbacks', '_parsed')
+
+    # attributes copied from the Django request for faster access
+    _mirrored = ('method', 'path', 'META')
+
+    # per request cache of the resource callbacks results
+    wm_callbacks = None
+
+    def __init__(self, request, *args, **kwargs):
+        d = self.__dict__
+        d['_wrapped'] = request
+        for name in self._mirrored:
+            d[name] = getattr(request, name)
 
         # add path args args to the request
-        self.url_args = args or []
-        self.url_kwargs = kwargs or {}
+        d['url_args'] = args or []
+        d['url_kwargs'] = kwargs or {}
+
+    def __getattr__(self, name):
+        try:
+            return getattr(self._wrapped, name)
+        except AttributeError:
+            if not hasattr(Request, name):
+                raise
+        return getattr(self.webob, name)
+
+    def __setattr__(self, name, value):
+        if name in self._local:
+            self.__dict__[name] = value
+            return
+        if name in self._mirrored:
+            self.__dict__[name] = value
+        setattr(self._wrapped, name, value)
+
+    def __delattr__(self, name):
+        if name in self._local:
+            del self.__dict__[name]
+            return
+        delattr(self._wrapped, name)
 
-    webob_POST = Request.POST
-    webob_WGET = Request.GET
+    def __repr__(self):
+        return "<WMRequest %r>" % self._wrapped
 
     @property
-    def str_POST(self):
+    def environ(self):
+        return self.META
 
-        clength = self.environ.get('CONTENT_LENGTH')
+    @property
+    def webob(self):
+        """ a WebOb request on a copy of the environ. It reads the body
+        through the Django request, so both can be used. """
         try:
-            return super(WMRequest, self).str_POST
-        finally:
-            self.environ['CONTENT_LENGTH'] = clength
-            self._seek_input()
+            return self.__dict__['_webob']
+        except KeyError:
+            pass
+        environ = self.META.copy()
+        environ['wsgi.input'] = BodyInput(self._wrapped)
+        return self.__dict__.setdefault('_webob', Request(environ))
 
-    def _load_post_and_files(self):
-        try:
-            return WSGIRequest._load_post_and_files(self)
-        finally:
-            # "Resetting" the input so WebOb will read it:
-            self._seek_input()
-    
-    def _seek_input(self):
-        if "wsgi.input" in self.environ:
+    @property
+    def headers(self):
+        """ the request headers as a case-insensitive dict-like
+        object """
+        return self.__dict__.setdefault('_headers',
+                EnvironHeaders(self.META))
+
+    @property
+    def content_type(self):
+        """ the request content type without its parameters """
+        return self.META.get('CONTENT_TYPE', '').split(';', 1)[0]
+
+    #
+    # request body
+    #
+
+    @property
+    def body(self):
+        """ the request body. It is read once from ``wsgi.input`` and
+        shared with the Django request. """
+        return self._wrapped.raw_post_data
+
+    @property
+    def body_file(self):
+        """ a file-like object to read the request body. If the body
+        hasn't been read yet, the input is consumed while reading from
+        this object and isn't available from ``body`` or ``POST``
+        anymore. """
+        if hasattr(self._wrapped, '_raw_post_data'):
+            return StringIO(self._wrapped._raw_post_data)
+        # HttpRequest reads from the input stream
+        return self._wrapped
+
+    @property
+    def POST(self):
+        """ the form data sent with a POST or a PUT request. It is
+        parsed once and shared with the Django request. """
+        req = self._wrapped
+        if not hasattr(req, '_post') and self.method == "PUT":
+            # Django only parses the body of POST requests.
+            req.method = "POST"
             try:
-                self.environ['wsgi.input'].seek(0)
-            except AttributeError:
-                pass
+                req._load_post_and_files()
+            finally:
+                req.method = "PUT"
+            req.PUT = req._post
+        return req.POST
+
+    @property
+    def webob_POST(self):
+        """ the form data parsed by WebOb """
+        return self.webob.POST
+
+    @property
+    def webob_WGET(self):
+        """ the query string parsed by WebOb """
+        return self.webob.GET
+
+    @property
+    def str_POST(self):
+        return self.webob.str_POST
+
+    @property
+    def FILES(self):
+        self.POST
+        return self._wrapped.FILES
+
+    #
+    # headers
+    #
+
+    accept = parsed_header('accept', 'HTTP_ACCEPT')
+    accept_charset = parsed_header('accept_charset', 'HTTP_ACCEPT_CHARSET')
+    accept_encoding = parsed_header('accept_encoding',
+            'HTTP_ACCEPT_ENCODING')
+    accept_language = parsed_header('accept_language',
+            'HTTP_ACCEPT_LANGUAGE')
+    if_match = parsed_header('if_match', 'HTTP_IF_MATCH')
+    if_none_match = parsed_header('if_none_match', 'HTTP_IF_NONE_MATCH')
+    if_modified_since = parsed_header('if_modified_since',
+            'HTTP_IF_MODIFIED_SINCE')
+    if_unmodified_since = parsed_header('if_unmodified_since',
+            'HTTP_IF_UNMODIFIED_SINCE')
+    if_range = parsed_header('if_range', 'HTTP_IF_RANGE')
+    range = parsed_header('range', 'HTTP_RANGE')
+
+def header_property(header, parse=None, serialize=None, doc=None):
+    """ a response header read from and written to ``_headers``. The
+    parsed value is kept until the header changes. Setting None or an
+    empty value removes the header. """
+    key = header.lower()
+
+    def fget(self):
+        raw = self._headers.get(key)
+        if raw is None:
+            return None
+        raw = raw[1]
+        if parse is None:
+            return raw
+        try:
+            cached_raw, value = self._parsed[key]
+            if cached_raw == raw:
+                return value
+        except KeyError:
+            pass
+        value = parse(raw)
+        self._parsed[key] = (raw, value)
+        return value
+
+    def fset(self, value):
+        if value is not None and serialize is not None:
+            value = serialize(value)
+        if not value:
+            fdel(self)
+            return
+        if isinstance(value, unicode):
+            value = value.encode('latin-1')
+        self._headers[key] = (header, value)
+
+    def fdel(self):
+        self._headers.pop(key, None)
+
+    return property(fget, fset, fdel, doc=doc)
+
+
+class ContentType(object):
+    """ a parsed Content-Type header """
+    __slots__ = ("value", "media_type", "params", "charset")
+
+    def __init__(self, value):
+        self.value = value
+        self.media_type, sep, self.params = value.partition(';')
+        match = CHARSET_RE.search(value)
+        if match:
+            self.charset = match.group(1)
+        else:
+            self.charset = None
+
+    def __getstate__(self):
+        return self.value
+
+    def __setstate__(self, value):
+        self.__init__(value)
+
 
 class WMResponse(HttpResponse):
-    """ Add some properties to HttpResponse """
+    """ Add some properties to HttpResponse. Headers are kept in the
+    ``_headers`` dict of HttpResponse, parsed values are cached until
+    the header changes. """
 
     status_code = 200
 
@@ -67,6 +278,9 @@ class WMResponse(HttpResponse):
     unicode_errors = 'strict'
     default_conditional_response = False
 
+    # content encoding negotiated, applied when the body is built
+    wm_encoding = None
+
     def __init__(self, content='', mimetype=None, status=None,
             content_type=None, request=None):
         if isinstance(status, basestring):
@@ -78,13 +292,12 @@ class WMResponse(HttpResponse):
             self.status_reason = None
 
         self.request = request
-        self._headerlist = []
+        self._parsed = {}
+        self._content_type = None
 
         HttpResponse.__init__(self, content=content,
                 status=status_code, content_type=content_type)
 
-        
-
     def _headerlist__get(self):
         """
         The list of response headers
@@ -92,20 +305,13 @@ class WMResponse(HttpResponse):
         return self._headers.values()
 
     def _headerlist__set(self, value):
+        if hasattr(value, 'items'):
+            value = value.items()
         self._headers = {}
-        if not isinstance(value, list):
-            if hasattr(value, 'items'):
-                value = value.items()
-            value = list(value)
-        
-        headers = ResponseHeaders.view_list(self.headerlist)
-        for hname in headers.keys():
-            self._headers[hname.lower()] = (hname, headers[hname])
-        self._headerlist = value
-
+        for hname, hvalue in value:
+            self[hname] = hvalue
 
     def _headerlist__del(self):
-        self.headerlist = []
         self._headers = {}
 
     headerlist = property(_headerlist__get, _headerlist__set, _headerlist__del, doc=_headerlist__get.__doc__)
@@ -123,46 +329,39 @@ class WMResponse(HttpResponse):
     def __getitem__(self, header):
         return self._headers[header.lower()][1]
 
-    allow = list_header('Allow', '14.7')
-    ## FIXME: I realize response.vary += 'something' won't work.  It should.
-    ## Maybe for all listy headers.
-    vary = list_header('Vary', '14.44')
+    allow = header_property('Allow', parse_list, serialize_list)
+    vary = header_property('Vary', parse_list, serialize_list)
 
-    content_length = converter(
-        header_getter('Content-Length', '14.17'),
-        parse_int, serialize_int, 'int')
+    content_length = header_property('Content-Length', parse_int,
+            serialize_int)
 
-    content_encoding = header_getter('Content-Encoding', '14.11')
-    content_language = list_header('Content-Language', '14.12')
-    content_location = header_getter('Content-Location', '14.14')
-    content_md5 = header_getter('Content-MD5', '14.14')
-    # FIXME: a special ContentDisposition type would be nice
-    content_disposition = header_getter('Content-Disposition', '19.5.1')
+    content_encoding = header_property('Content-Encoding')
+    content_language = header_property('Content-Language', parse_list,
+            serialize_list)
+    content_location = header_property('Content-Location')
+    content_md5 = header_property('Content-MD5')
+    content_disposition = header_property('Content-Disposition')
 
-    accept_ranges = header_getter('Accept-Ranges', '14.5')
-    content_range = converter(
-        header_getter('Content-Range', '14.16'),
-        parse_content_range, serialize_content_range, 'ContentRange object')
+    accept_ranges = header_property('Accept-Ranges')
+    content_range = header_property('Content-Range', parse_content_range,
+            serialize_content_range)
 
-    date = date_header('Date', '14.18')
-    expires = date_header('Expires', '14.21')
-    last_modified = date_header('Last-Modified', '14.29')
+    date = header_property('Date', parse_date, serialize_date)
+    expires = header_property('Expires', parse_date, serialize_date)
+    last_modified = header_property('Last-Modified', parse_date,
+            serialize_date)
 
-    etag = converter(
-        header_getter('ETag', '14.19'),
-        parse_etag_response, serialize_etag_response, 'Entity tag')
+    etag = header_property('ETag', parse_etag_response,
+            serialize_etag_response)
 
-    location = header_getter('Location', '14.30')
-    pragma = header_getter('Pragma', '14.32')
-    age = converter(
-        header_getter('Age', '14.6'),
-        parse_int_safe, serialize_int, 'int')
+    location = header_property('Location')
+    pragma = header_property('Pragma')
+    age = header_property('Age', parse_int_safe, serialize_int)
 
-    retry_after = converter(
-        header_getter('Retry-After', '14.37'),
-        parse_date_delta, serialize_date_delta, 'HTTP date or delta seconds')
+    retry_after = header_property('Retry-After', parse_date_delta,
+            serialize_date_delta)
 
-    server = header_getter('Server', '14.38')
+    server = header_property('Server')
 
     def _convert_to_ascii(self, header, value):
         def convert(s):
@@ -172,6 +371,16 @@ class WMResponse(HttpResponse):
                 return s
         return convert(header), convert(value)
 
+    def _parsed_content_type(self):
+        """ return the parsed Content-Type header or None """
+        header = self._headers.get('content-type')
+        if header is None:
+            return None
+        ctype = self._content_type
+        if ctype is None or ctype.value != header[1]:
+            ctype = self._content_type = ContentType(header[1])
+        return ctype
+
     #
     # charset
     #
@@ -180,39 +389,34 @@ class WMResponse(HttpResponse):
         """
         Get/set the charset (in the Content-Type)
         """
-        header = self._headers.get('content-type')
-        if not header:
+        ctype = self._parsed_content_type()
+        if ctype is None:
             return None
-        match = CHARSET_RE.search(header[1])
-        if match:
-            return match.group(1)
-        return None
+        return ctype.charset
 
     def _charset__set(self, charset):
         if charset is None:
             del self.charset
             return
-        try:
-            hname, header = self._headers.pop('content-type')
-        except KeyError:
+        ctype = self._parsed_content_type()
+        if ctype is None:
             raise AttributeError(
                     "You cannot set the charset when no content-type is defined")
-            match = CHARSET_RE.search(header)
+        header = ctype.value
+        match = CHARSET_RE.search(header)
         if match:
             header = header[:match.start()] + header[match.end():]
         header += '; charset=%s' % charset
-        self._headers['content-type'] = hname, header
+        self['Content-Type'] = header
 
     def _charset__del(self):
-        try:
-            hname, header = self._headers.pop('content-type')
-        except KeyError:
+        ctype = self._parsed_content_type()
+        if ctype is None or ctype.charset is None:
             # Don't need to remove anything
             return
-        match = CHARSET_RE.search(header)
-        if match:
-            header = header[:match.start()] + header[match.end():]
-        self[hname] = header
+        match = CHARSET_RE.search(ctype.value)
+        self['Content-Type'] = ctype.value[:match.start()] + \
+                ctype.value[match.end():]
 
     charset = property(_charset__get, _charset__set, _charset__del, doc=_charset__get.__doc__)
 
@@ -230,19 +434,16 @@ class WMResponse(HttpResponse):
         content_type, any existing parameters will be deleted;
         otherwise they will be preserved.
         """
-        header = self._headers.get('content-type')
-
-        if not header:
+        ctype = self._parsed_content_type()
+        if ctype is None:
             return None
-        return header[1].split(';', 1)[0]
+        return ctype.media_type
 
     def _content_type__set(self, value):
         if ';' not in value:
-            if 'content-type' in self._headers:
-                header = self._headers.get('content-type')
-                if ';' in header[1]:
-                    params = header[1].split(';', 1)[1]
-                    value += ';' + params
+            ctype = self._parsed_content_type()
+            if ctype is not None and ctype.params:
+                value += ';' + ctype.params
         self['Content-Type'] = value
 
     def _content_type__del(self):
@@ -266,15 +467,12 @@ class WMResponse(HttpResponse):
         (This is not a view, set to change, modifications of the dict would not be
         applied otherwise)
         """
-        if not 'content-type' in self._headers:
+        ctype = self._parsed_content_type()
+        if ctype is None or not ctype.params:
             return {}
 
-        params = self._headers.get('content-type')
-        if ';' not in params[1]:
-            return {}
-        params = params[1].split(';', 1)[1]
         result = {}
-        for match in _PARAM_RE.finditer(params):
+        for match in _PARAM_RE.finditer(ctype.params):
             result[match.group(1)] = match.group(2) or match.group(3) or ''
         return result
 
@@ -289,21 +487,17 @@ class WMResponse(HttpResponse):
                 ## I think it might be simply illegal
                 v = '"%s"' % v.replace('"', '\\"')
             params.append('; %s=%s' % (k, v))
-        ct = self._headers.pop('content-type')
-        if not ct:
+        ctype = self._parsed_content_type()
+        if ctype is None:
             ct = ''
         else:
-            ct = ct[1].split(';', 1)[0]
-        ct += ''.join(params)
-        self._headers['content-type'] = 'Content-Type', ct
+            ct = ctype.media_type
+        self['Content-Type'] = ct + ''.join(params)
 
-    def _content_type_params__del(self, value):
-        try:
-            header = self._headers['content-type']
-        except KeyError:
-            return
-
-        self._headers['content-type'] = header[0], header[1].split(';', 1)[0]
+    def _content_type_params__del(self):
+        ctype = self._parsed_content_type()
+        if ctype is not None:
+            self['Content-Type'] = ctype.media_type
 
     content_type_params = property(
             _content_type_params__get,
@@ -311,4 +505,3 @@ class WMResponse(HttpResponse):
             _content_type_params__del,
             doc=_content_type_params__get.__doc__
             )
-